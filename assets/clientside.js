@@ -0,0 +1,41 @@
+// Clientside callbacks for the Resort Finder map. These are only registered when the app is started with CLIENTSIDE_FILTERING set.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    resorts: {
+        // Filter the stored resort columns by the selected price and options, the same way global_resortmap does on the server,
+        // then swap the filtered arrays into the trace of the stored map figure. The layout of the figure is reused as-is.
+        filter_resort_map: function (price, options, columns) {
+            if (!columns) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            // Each selected option sets its bit in the required mask, and a resort must have all of the required bits
+            var required = 0;
+            (options || []).forEach(function (option) {
+                required |= 1 << columns.options.indexOf(option);
+            });
+            var lat = [], lon = [], z = [], customdata = [];
+            for (var i = 0; i < columns.price.length; i++) {
+                if (columns.price[i] < price && (columns.option_bits[i] & required) === required) {
+                    lat.push(columns.lat[i]);
+                    lon.push(columns.lon[i]);
+                    z.push(columns.z[i]);
+                    customdata.push(columns.customdata[i]);
+                }
+            }
+            var trace = Object.assign({}, columns.figure.data[0], {
+                lat: lat,
+                lon: lon,
+                z: z,
+                customdata: customdata,
+            });
+            var title = "Ski Resorts by Total Slopes with a Lift Ticket Price of Less Than $" + price;
+            return [title, Object.assign({}, columns.figure, {data: [trace]})];
+        },
+        // Look up the countries of the selected continent in the catalog stored in the layout, the same way continent_filter does on the server
+        country_options: function (continent, continents) {
+            if (!continents) {
+                return window.dash_clientside.no_update;
+            }
+            return continents[continent] || [];
+        },
+    },
+});
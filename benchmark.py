@@ -0,0 +1,169 @@
+import argparse
+import itertools
+import json
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+import ski_resorts_app
+from resorts_data import RANK_COLUMNS, expand_resorts
+
+# Calls every Dash callback of the app directly, without a browser or a server, over its full input space and reports latency percentiles, peak memory allocated per call and the size of the JSON sent back to the browser.
+# Run it on the real dataset and on synthetic copies scaled up from it:
+#     python benchmark.py --scales 1 10 100 1000
+
+
+# Make a synthetic dataset by repeating the real resorts factor times. Each copy gets new IDs and resort names and slightly moved coordinates and prices, while the countries stay the same so every country grows by the same factor.
+def scale_resorts(df, factor, seed=0):
+    if factor == 1:
+        return df
+    rng = np.random.default_rng(seed)
+    scaled = pd.concat([df] * factor, ignore_index=True)
+    copy_number = np.repeat(np.arange(factor), len(df))
+    scaled["ID"] = np.arange(1, len(scaled) + 1)
+    scaled["Resort"] = [
+        name if copy == 0 else f"{name} #{copy}"
+        for name, copy in zip(scaled["Resort"], copy_number)
+    ]
+    moved = copy_number > 0
+    for column in ["Latitude", "Longitude"]:
+        scaled.loc[moved, column] += rng.uniform(-0.5, 0.5, moved.sum())
+    scaled.loc[moved, "Price"] = np.clip(
+        scaled.loc[moved, "Price"] + rng.integers(-10, 11, moved.sum()), 0, None
+    )
+    return scaled
+
+
+# Every input each callback can receive from the layout of the given dataset version
+def callback_inputs(version):
+    option_sets = [
+        list(options)
+        for count in range(len(ski_resorts_app.OPTION_COLUMNS) + 1)
+        for options in itertools.combinations(ski_resorts_app.OPTION_COLUMNS, count)
+    ]
+    prices = range(
+        ski_resorts_app.PRICE_MIN,
+        ski_resorts_app.PRICE_MAX + 1,
+        ski_resorts_app.PRICE_STEP,
+    )
+    return {
+        "global_resortmap": [
+            (price, options) for price in prices for options in option_sets
+        ],
+        "continent_filter": [
+            (continent,) for continent in version.resorts["Continent"].unique()
+        ],
+        "graph_generator": [
+            (country, metric)
+            for country in version.top_resorts
+            for metric in version.catalog["metrics"]
+        ],
+        "report_card": [
+            ({"points": [{"customdata": [name, country]}]},)
+            for country, name in version.rank_index["rows"]
+        ],
+    }
+
+
+# Call one callback with each of the inputs and collect the latency, the peak memory allocated during the call and the size of the serialized response
+def run_callback(callback, inputs, before_call=None):
+    latencies, peaks, sizes = [], [], []
+    # One untimed pass first fills the caches and builds the figure templates, which are made once per process. Without a per-call reset the timed pass then measures the steady state, and with one it measures a cache miss
+    for args in inputs:
+        callback(*args)
+    for args in inputs:
+        if before_call is not None:
+            before_call()
+        start = time.perf_counter()
+        output = callback(*args)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(to_json_plotly(output)))
+    # Memory is measured in a second pass, because tracing allocations slows the calls down too much to time them in the same pass
+    tracemalloc.start()
+    for args in inputs:
+        if before_call is not None:
+            before_call()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        callback(*args)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    latencies = np.array(latencies) * 1000
+    return {
+        "calls": len(inputs),
+        "p50_ms": np.percentile(latencies, 50),
+        "p95_ms": np.percentile(latencies, 95),
+        "p99_ms": np.percentile(latencies, 99),
+        "max_ms": latencies.max(),
+        "peak_alloc_kib": np.median(peaks) / 1024,
+        "payload_kib": np.mean(sizes) / 1024,
+    }
+
+
+# The figure cache in front of each callback that has one
+FIGURE_CACHES = {
+    "global_resortmap": ski_resorts_app.resortmap_cache,
+    "graph_generator": ski_resorts_app.resort_graph_cache,
+}
+
+
+# Publish the dataset at the given scale and benchmark every callback on it. Inputs are sampled down to max_calls per callback so the large scales finish in reasonable time.
+def run_scale(base, factor, max_calls, seed=0):
+    version = ski_resorts_app.dataset.replace(scale_resorts(base, factor, seed))
+    sampler = random.Random(seed)
+    results = {}
+    for name, inputs in callback_inputs(version).items():
+        if len(inputs) > max_calls:
+            inputs = sampler.sample(inputs, max_calls)
+        callback = getattr(ski_resorts_app, name)
+        # The map and bar graph callbacks are measured both without their figure cache, which is what a cache miss costs, and with a warm cache
+        if name in FIGURE_CACHES:
+            results[f"{name} (cold)"] = run_callback(
+                callback, inputs, FIGURE_CACHES[name].clear
+            )
+        results[name] = run_callback(callback, inputs)
+    return {
+        "rows": len(version.resorts),
+        "memory_mib": [float(usage) / 2**20 for usage in version.memory_usage],
+        "callbacks": results,
+    }
+
+
+def print_results(factor, result):
+    before, after = result["memory_mib"]
+    print(
+        f"\nScale {factor}x ({result['rows']} resorts, {before:.2f} MiB in memory before compaction, {after:.2f} MiB after)"
+    )
+    print(
+        f"{'callback':<26}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'alloc KiB':>12}{'payload KiB':>13}"
+    )
+    for name, stats in result["callbacks"].items():
+        print(
+            f"{name:<26}{stats['calls']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}{stats['peak_alloc_kib']:>12.1f}{stats['payload_kib']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Dash callbacks of the ski resorts app on the real dataset and on scaled synthetic datasets."
+    )
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--max-calls", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    base = expand_resorts(
+        ski_resorts_app.dataset.current.resorts.drop(columns=RANK_COLUMNS)
+    )
+    all_results = {}
+    for factor in args.scales:
+        all_results[factor] = run_scale(base, factor, args.max_calls, args.seed)
+        print_results(factor, all_results[factor])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
@@ -0,0 +1,167 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+import time
+
+from flask import Response, request
+
+# Opt-in instrumentation of the Dash callbacks, exposed in the Prometheus text format. Set CALLBACK_METRICS to turn it on; when it is unset, instrumented() and phase() hand back the callback and a no-op context, so there is no overhead at all.
+# Every gunicorn worker keeps its own histograms, so each scrape of the metrics route reports the worker that happened to answer it.
+ENABLED = bool(os.environ.get("CALLBACK_METRICS"))
+
+# Bucket upper bounds for the latency histograms, in seconds, and for the response size histogram, in bytes
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+# A Prometheus histogram with labels. Each observation only takes a lock and bumps three numbers, so it is cheap enough to leave on in production.
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        # Maps a sorted tuple of label pairs to [bucket counts, sum, count]. The bucket counts are per bucket here and only made cumulative when exposed.
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._series.items()
+            ]
+        for key, counts, total, count in sorted(series):
+            labels = ",".join(f'{name}="{value}"' for name, value in key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return "\n".join(lines)
+
+
+CALLBACK_SECONDS = Histogram(
+    "dash_callback_duration_seconds",
+    "Wall time spent in each Dash callback.",
+    LATENCY_BUCKETS,
+)
+PHASE_SECONDS = Histogram(
+    "dash_callback_phase_seconds",
+    "Time spent in each phase of a Dash callback: filtering the data and building the figure.",
+    LATENCY_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "dash_callback_response_bytes",
+    "Size of the JSON response of each Dash callback.",
+    SIZE_BUCKETS,
+)
+
+# The name of the running callback, so that phases can be attributed to it. It is a context variable rather than a thread-local, so that work handed to another thread with contextvars.copy_context() is still attributed to the callback.
+_callback = contextvars.ContextVar("callback", default=None)
+
+
+# Wrap a callback function so that its wall time is recorded. Put it below @app.callback, so Dash registers the wrapper.
+def instrumented(callback):
+    if not ENABLED:
+        return callback
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        token = _callback.set(name)
+        start = time.perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=name)
+            _callback.reset(token)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        callback = _callback.get()
+        # Work done outside of a callback, such as pre-warming the figure cache at startup, isn't recorded
+        if callback is not None:
+            PHASE_SECONDS.observe(
+                time.perf_counter() - start, callback=callback, phase=name
+            )
+
+
+# Time one phase of the running callback, e.g. with phase("figure"): fig = px.bar(...)
+def phase(name):
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _timed_phase(name)
+
+
+# Record the size of every callback response and serve all of the histograms from the metrics route of the Flask server.
+# Each collector is a function returning extra lines in the Prometheus text format, which are appended to the histograms.
+def install_metrics(app, path="/metrics", collectors=()):
+    if not ENABLED:
+        return
+    server = app.server
+
+    @server.after_request
+    def record_response_size(response):
+        if request.path.endswith("/_dash-update-component"):
+            # Dash has already parsed the request body, so this reads Flask's cached copy
+            output = (request.get_json(silent=True) or {}).get("output")
+            callback = app.callback_map.get(output, {}).get("callback")
+            RESPONSE_BYTES.observe(
+                response.calculate_content_length() or 0,
+                callback=callback.__name__ if callback else output,
+            )
+        return response
+
+    def metrics():
+        sections = [
+            histogram.expose()
+            for histogram in (CALLBACK_SECONDS, PHASE_SECONDS, RESPONSE_BYTES)
+        ]
+        sections.extend(collector() for collector in collectors)
+        return Response(
+            "\n".join(sections) + "\n", mimetype="text/plain; version=0.0.4"
+        )
+
+    server.add_url_rule(path, "metrics", metrics)
@@ -0,0 +1,192 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+import load_test
+
+# Checks that the shared-memory preload mode saves memory on every worker compared with plain gunicorn (Linux only, it reads /proc).
+# For every worker count it starts gunicorn twice, once with the preload config and once without any config, drives some load through all callbacks, then reads the memory of the master and of each worker from /proc/<pid>/smaps_rollup:
+#     RSS counts every page a process maps, including the shared ones, PSS splits shared pages evenly between the processes sharing them, private is what the process holds alone, and shared is what it maps together with others.
+# The check fails when, at any worker count, the median private memory per worker of the preload run is more than the ratio of the plain run's, or when the total PSS of the preload run grows by more than the ratio of the plain run's growth for each added worker.
+# It also fails when the dataset arena, the anonymous shared mapping that share_arrays creates, is missing from a preload worker or isn't mostly counted as shared in its /proc/<pid>/smaps.
+#     python check_worker_memory.py --workers 1 2 4 8
+
+
+def wait_until_up(url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"gunicorn didn't answer on {url} within {timeout}s")
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The parent pid is the second field after the parenthesized command name
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if parent == pid:
+                children.append(int(entry))
+    return children
+
+
+# The name /proc gives anonymous shared mappings, such as the dataset arena that share_arrays creates with mmap
+ARENA_MAPPING = "/dev/zero (deleted)"
+
+
+# Read RSS, PSS, private and shared memory of a process in MiB, along with the resident and shared memory of its dataset arena
+def memory_of(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    arena = {"Rss": 0, "Shared_Clean": 0, "Shared_Dirty": 0}
+    in_arena = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            parts = line.split()
+            # A line that starts a mapping reads "<start>-<end> <perms> <offset> <dev> <inode> [<name>]", and the lines describing it start with a field name such as "Rss:"
+            if parts and not parts[0].endswith(":"):
+                in_arena = " ".join(parts[5:]) == ARENA_MAPPING
+            elif in_arena and parts[0].rstrip(":") in arena:
+                arena[parts[0].rstrip(":")] += int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+        "shared": fields["Shared_Clean"] + fields["Shared_Dirty"],
+        "arena_rss": arena["Rss"],
+        "arena_shared": arena["Shared_Clean"] + arena["Shared_Dirty"],
+    }
+
+
+# Start gunicorn with the given number of workers and config, or plain gunicorn without a config, and return the memory of its master and of each worker under load
+def measure(workers, config, port, load_seconds):
+    url = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "--workers",
+        str(workers),
+        "--bind",
+        f"127.0.0.1:{port}",
+        "ski_resorts_app:server",
+    ]
+    env = dict(os.environ)
+    if config:
+        command[3:3] = ["-c", config]
+    else:
+        env.pop("SHARED_DATASET", None)
+    master = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env
+    )
+    try:
+        wait_until_up(url, timeout=120)
+        # Wait for every worker to boot, then make each of them serve some requests so the pages they touch at runtime are counted
+        while len(child_pids(master.pid)) < workers:
+            time.sleep(0.5)
+        load_test.run(url, concurrency=workers * 2, duration=load_seconds)
+        return memory_of(master.pid), [memory_of(pid) for pid in child_pids(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that the shared-memory preload mode keeps per-worker memory well below plain gunicorn's."
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument(
+        "--config",
+        default="gunicorn_preload.conf.py",
+        help="Gunicorn config of the shared-memory preload mode, compared against plain gunicorn",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--load-seconds", type=float, default=5)
+    parser.add_argument(
+        "--ratio",
+        type=float,
+        default=0.5,
+        help="Largest allowed ratio of the preload run's memory per worker to the plain run's",
+    )
+    parser.add_argument(
+        "--arena-shared",
+        type=float,
+        default=0.9,
+        help="Smallest share of the resident dataset arena of a preload worker that has to be counted as shared",
+    )
+    args = parser.parse_args()
+    if not args.config:
+        parser.error(
+            "--config is required, since it is compared against plain gunicorn"
+        )
+
+    print(
+        f"{'mode':>8}{'workers':>8}{'RSS MiB':>12}{'PSS MiB':>12}{'private MiB':>14}{'shared MiB':>13}{'arena MiB':>12}{'total PSS MiB':>16}"
+    )
+    private, total_pss, failures = {}, {}, []
+    for count in sorted(args.workers):
+        for mode, config in [("plain", None), ("preload", args.config)]:
+            master, usage = measure(count, config, args.port, args.load_seconds)
+            private[mode, count] = np.median([worker["private"] for worker in usage])
+            # The master counts towards the total, since it holds a share of the pages it has in common with the workers
+            total_pss[mode, count] = master["pss"] + sum(
+                worker["pss"] for worker in usage
+            )
+            print(
+                f"{mode:>8}{count:>8}{np.median([worker['rss'] for worker in usage]):>12.1f}{np.median([worker['pss'] for worker in usage]):>12.1f}{private[mode, count]:>14.1f}{np.median([worker['shared'] for worker in usage]):>13.1f}{np.median([worker['arena_rss'] for worker in usage]):>12.1f}{total_pss[mode, count]:>16.1f}"
+            )
+            if mode == "preload":
+                for worker in usage:
+                    if worker["arena_rss"] == 0:
+                        failures.append(
+                            f"a worker with {count} worker(s) has no resident dataset arena"
+                        )
+                    elif (
+                        worker["arena_shared"] < worker["arena_rss"] * args.arena_shared
+                    ):
+                        failures.append(
+                            f"only {worker['arena_shared']:.1f} of the {worker['arena_rss']:.1f} MiB of the dataset arena of a worker with {count} worker(s) is shared"
+                        )
+        if private["preload", count] > private["plain", count] * args.ratio:
+            failures.append(
+                f"private memory per worker with {count} worker(s) is {private['preload', count]:.1f} MiB with preload against {private['plain', count]:.1f} MiB without"
+            )
+    smallest, largest = min(args.workers), max(args.workers)
+    if largest > smallest:
+        growth = {
+            mode: (total_pss[mode, largest] - total_pss[mode, smallest])
+            / (largest - smallest)
+            for mode in ["plain", "preload"]
+        }
+        print(
+            f"Total PSS per added worker: {growth['plain']:.1f} MiB without preload, {growth['preload']:.1f} MiB with"
+        )
+        if growth["preload"] > growth["plain"] * args.ratio:
+            failures.append(
+                f"total PSS grows by {growth['preload']:.1f} MiB per worker with preload against {growth['plain']:.1f} MiB without"
+            )
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(
+        "OK: preload workers hold well under the memory of plain workers, and share the dataset arena"
+    )
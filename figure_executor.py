@@ -0,0 +1,193 @@
+import collections
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Runs figure builds with single-flight coalescing: while a figure is being built, every other request for the same key waits for that build instead of starting its own.
+# With max_workers set, builds run on a bounded thread pool, which caps how many figures a worker builds at once however many request threads it has (e.g. gunicorn's gthread workers).
+# With max_workers at 0, the first request builds the figure on its own thread and the others still wait for it.
+# Threads don't survive a fork, so the pool is only started on the first build of each process, and a forked child (e.g. a gunicorn worker forked from a preloaded master) starts over with a pool and in-flight table of its own.
+# FigureCache holds built figures. Its keys should be plain values such as a dataset version number rather than the version itself, so that cached entries never keep a superseded version alive.
+
+
+class FigureExecutor:
+    def __init__(self, max_workers=0):
+        self.max_workers = max_workers
+        self._reset()
+        # Builds started, and requests that joined a build already in flight instead of starting one
+        self.builds = 0
+        self.coalesced = 0
+        os.register_at_fork(after_in_child=self._reset)
+
+    # Forget the pool and the builds in flight, whose threads only exist in the parent of a fork
+    def _reset(self):
+        self._pool = None
+        self._lock = threading.Lock()
+        # Maps the key of every build that hasn't finished yet to the Future its waiters share
+        self._in_flight = {}
+        # Builds waiting for a pool thread, and builds in progress
+        self.queued = 0
+        self.running = 0
+
+    # Return function(*args), joining the build already in flight for the same key if there is one. Exceptions raised by the build are raised in every waiter.
+    def run(self, key, function, *args):
+        return self._run(key, None, None, function, args)
+
+    # Return the value cached for the key, building it with function(*args) on a miss. Cache hits never wait for the pool, and concurrent misses share one build.
+    # The build puts its result in the cache before it leaves the in-flight table, and a miss looks in the cache again under the lock before starting a build, so a request can never miss both and start a second build.
+    def cached(self, cache, key, function, *args):
+        value = cache.get(key)
+        if value is None:
+            value = self._run((cache, key), cache, key, function, args)
+        return value
+
+    def _run(self, flight, cache, key, function, args):
+        with self._lock:
+            future = self._in_flight.get(flight)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                if cache is not None:
+                    value = cache.peek(key)
+                    if value is not None:
+                        return value
+                future = self._in_flight[flight] = Future()
+                self.builds += 1
+                self.queued += 1
+                leader = True
+        if leader:
+            # The build runs in a copy of the caller's context, so that the callback metrics still attribute its phases to the callback
+            context = contextvars.copy_context()
+            if self.max_workers:
+                with self._lock:
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(
+                            self.max_workers, thread_name_prefix="figure"
+                        )
+                self._pool.submit(
+                    context.run,
+                    self._build,
+                    flight,
+                    future,
+                    cache,
+                    key,
+                    function,
+                    args,
+                )
+            else:
+                context.run(self._build, flight, future, cache, key, function, args)
+        return future.result()
+
+    def _build(self, flight, future, cache, key, function, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            value = function(*args)
+            if cache is not None:
+                cache.put(key, value)
+            future.set_result(value)
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                self.running -= 1
+                del self._in_flight[flight]
+
+    # The queue depth and coalescing counters in the Prometheus text format, for the metrics route
+    def metrics(self):
+        with self._lock:
+            values = [
+                (
+                    "figure_builds_queued",
+                    "gauge",
+                    "Figure builds waiting for a pool thread.",
+                    self.queued,
+                ),
+                (
+                    "figure_builds_running",
+                    "gauge",
+                    "Figure builds in progress.",
+                    self.running,
+                ),
+                (
+                    "figure_builds_total",
+                    "counter",
+                    "Figure builds started.",
+                    self.builds,
+                ),
+                (
+                    "figure_requests_coalesced_total",
+                    "counter",
+                    "Figure requests that waited for an identical build already in flight.",
+                    self.coalesced,
+                ),
+            ]
+        lines = []
+        for name, kind, description, value in values:
+            lines.extend(
+                [
+                    f"# HELP {name} {description}",
+                    f"# TYPE {name} {kind}",
+                    f"{name} {value}",
+                ]
+            )
+        return "\n".join(lines)
+
+
+# A bounded LRU cache of built figures that is safe to use from several threads, with hit and miss counters like functools.lru_cache
+class FigureCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value for the key, or None when it isn't cached
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    # Return the cached value for the key without counting a hit or a miss, or None when it isn't cached
+    def peek(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    # Return the cached value for the key, calling function(*args) to build and cache it on a miss
+    def get_or_build(self, key, function, *args):
+        value = self.get(key)
+        if value is None:
+            value = function(*args)
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "maxsize": self.maxsize,
+                "currsize": len(self._entries),
+            }
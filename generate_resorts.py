@@ -0,0 +1,191 @@
+import argparse
+
+import pandas as pd
+import numpy as np
+
+from resorts_data import FLAG_COLUMNS, RANK_COLUMNS, expand_resorts, load_resorts
+from resorts_ingest import SCHEMA
+
+# Generates synthetic resort datasets of any size, modelled on the real resorts, for testing how far the app scales. The dataset is written as a CSV or Parquet dump that the ingest pipeline reads.
+# Every synthetic resort is drawn from one real resort: it lies in the same country, within a degree of it, and its price, elevation, slopes and lifts are the real ones scaled by a random factor, so the mix of countries and the spread of every column follow the real data.
+# Parts of the dump can be made dirty on purpose, to exercise the validation and deduplication of the ingest pipeline:
+#     python generate_resorts.py --rows 1000000 --output resorts_1m.parquet
+#     python generate_resorts.py --rows 1000000 --output resorts_1m.csv --duplicates 0.02 --invalid 0.001
+
+# Rows generated and written at a time
+CHUNK_ROWS = 100_000
+
+# Words that synthetic resort names are made of
+NAME_WORDS = [
+    "Alpen",
+    "Bear",
+    "Black",
+    "Cedar",
+    "Crystal",
+    "Eagle",
+    "Glacier",
+    "Grand",
+    "Hidden",
+    "High",
+    "Iron",
+    "Lake",
+    "Mont",
+    "North",
+    "Pine",
+    "Powder",
+    "Red",
+    "Silver",
+    "Snow",
+    "Stone",
+    "Sun",
+    "Val",
+    "White",
+    "Wolf",
+]
+NAME_SUFFIXES = ["Mountain", "Peak", "Ridge", "Valley", "Basin", "Bowl", "Alm", "Berg"]
+
+# The columns that are scaled together with the size of the resort, and the columns scaled on their own
+SIZE_COLUMNS = [
+    "Beginner slopes",
+    "Intermediate slopes",
+    "Difficult slopes",
+    "Snow cannons",
+    "Surface lifts",
+    "Chair lifts",
+    "Gondola lifts",
+    "Lift capacity",
+]
+
+
+# Generate one chunk of synthetic resorts, numbered from first_id, from the real resorts
+def generate_chunk(real, first_id, rows, rng):
+    template = real.iloc[rng.integers(0, len(real), rows)].reset_index(drop=True)
+    chunk = pd.DataFrame({"ID": np.arange(first_id, first_id + rows)})
+    words = rng.integers(0, len(NAME_WORDS), (rows, 2))
+    suffixes = rng.integers(0, len(NAME_SUFFIXES), rows)
+    # The ID keeps names unique within a country, so that no resort is a duplicate unless it is made one on purpose
+    chunk["Resort"] = [
+        f"{NAME_WORDS[first]} {NAME_WORDS[second]} {NAME_SUFFIXES[suffix]} {number}"
+        for (first, second), suffix, number in zip(words, suffixes, chunk["ID"])
+    ]
+    chunk["Latitude"] = np.clip(
+        template["Latitude"] + rng.uniform(-1, 1, rows), -90, 90
+    )
+    chunk["Longitude"] = np.clip(
+        template["Longitude"] + rng.uniform(-1, 1, rows), -180, 180
+    )
+    for column in ["Country", "Continent"]:
+        chunk[column] = template[column]
+    chunk["Price"] = np.clip(
+        np.rint(template["Price"] * rng.uniform(0.8, 1.2, rows)), 0, None
+    ).astype(np.int64)
+    chunk["Season"] = template["Season"]
+    # The base stays within the elevation range of the real resort's country, and the top is the real vertical drop above it
+    shift = rng.normal(0, 150, rows)
+    chunk["Lowest point"] = np.clip(np.rint(template["Lowest point"] + shift), 0, None)
+    chunk["Highest point"] = chunk["Lowest point"] + (
+        template["Highest point"] - template["Lowest point"]
+    ) * rng.uniform(0.7, 1.3, rows)
+    size = rng.lognormal(0, 0.4, rows)
+    for column in SIZE_COLUMNS:
+        chunk[column] = template[column] * size
+    for column in ["Lowest point", "Highest point"] + SIZE_COLUMNS:
+        chunk[column] = np.rint(chunk[column]).astype(np.int64)
+    chunk["Total slopes"] = np.maximum(
+        chunk[["Beginner slopes", "Intermediate slopes", "Difficult slopes"]].sum(
+            axis=1
+        ),
+        1,
+    )
+    chunk["Longest run"] = np.rint(template["Longest run"] * np.sqrt(size)).astype(
+        np.int64
+    )
+    chunk["Total lifts"] = chunk[["Surface lifts", "Chair lifts", "Gondola lifts"]].sum(
+        axis=1
+    )
+    # Each amenity is kept from the real resort most of the time, so the share of resorts offering it stays close to the real share
+    for column in FLAG_COLUMNS:
+        flip = rng.random(rows) < 0.1
+        chunk[column] = np.where(
+            flip, np.where(template[column] == "Yes", "No", "Yes"), template[column]
+        )
+    return chunk[[name for name, kind in SCHEMA]]
+
+
+# Make a share of the rows of a chunk dirty: duplicates repeat earlier resorts of the chunk with a different price and spelling, and invalid rows get a value the ingest pipeline rejects
+def dirty_chunk(chunk, duplicates, invalid, rng):
+    repeated = chunk.sample(frac=duplicates, random_state=rng) if duplicates else None
+    chunk = chunk.astype({"Latitude": object, "Price": object, "Snowparks": object})
+    broken = rng.random(len(chunk)) < invalid
+    kinds = rng.integers(0, 3, len(chunk))
+    chunk.loc[broken & (kinds == 0), "Latitude"] = 123.0
+    chunk.loc[broken & (kinds == 1), "Price"] = "n/a"
+    chunk.loc[broken & (kinds == 2), "Snowparks"] = "Maybe"
+    if repeated is not None:
+        repeated = repeated.assign(
+            Resort=repeated["Resort"].str.upper() + " ",
+            Price=(repeated["Price"] + rng.integers(-5, 6, len(repeated))).clip(
+                lower=0
+            ),
+        )
+        chunk = pd.concat([chunk, repeated], ignore_index=True)
+    return chunk
+
+
+# Write the synthetic dataset a chunk at a time, as CSV or as Parquet depending on the extension of the output. Parquet requires pyarrow
+def generate_resorts(
+    output, rows, seed=0, duplicates=0.0, invalid=0.0, chunk_rows=CHUNK_ROWS
+):
+    real = expand_resorts(load_resorts().drop(columns=RANK_COLUMNS))
+    rng = np.random.default_rng(seed)
+    writer = None
+    try:
+        for start in range(0, rows, chunk_rows):
+            chunk = generate_chunk(real, start + 1, min(chunk_rows, rows - start), rng)
+            chunk = dirty_chunk(chunk, duplicates, invalid, rng)
+            if output.lower().endswith(".parquet"):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                # The dirty columns mix numbers and text, so everything is written as text like in a CSV dump
+                table = pa.Table.from_pandas(
+                    chunk.astype(str) if duplicates or invalid else chunk,
+                    preserve_index=False,
+                )
+                if writer is None:
+                    writer = pq.ParquetWriter(output, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(
+                    output,
+                    mode="w" if start == 0 else "a",
+                    index=False,
+                    header=start == 0,
+                )
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic resorts dataset modelled on the real resorts, as a CSV or Parquet dump."
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", default="resorts_synthetic.parquet")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--duplicates",
+        type=float,
+        default=0.0,
+        help="Share of resorts that appear a second time, with a different price and spelling",
+    )
+    parser.add_argument(
+        "--invalid",
+        type=float,
+        default=0.0,
+        help="Share of rows with a value that the ingest pipeline rejects",
+    )
+    args = parser.parse_args()
+    generate_resorts(args.output, args.rows, args.seed, args.duplicates, args.invalid)
+    print(f"Wrote {args.rows} synthetic resorts to {args.output}")
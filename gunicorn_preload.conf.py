@@ -0,0 +1,28 @@
+import gc
+import os
+
+# Gunicorn configuration for the shared-memory preload mode:
+#     gunicorn -c gunicorn_preload.conf.py ski_resorts_app:server
+# The app is imported once in the master, which loads the dataset, builds its indexes and moves them into read-only shared memory. The workers are forked from the master afterwards and attach to the same pages instead of loading their own copy.
+
+# Tell the app to move the dataset into shared memory when it is imported
+os.environ.setdefault("SHARED_DATASET", "1")
+
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+
+# Threaded workers serve several requests at once, so that concurrent identical figure requests can be coalesced by the app's figure executor
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+
+# Move every object created while loading the app into the permanent generation before any worker is forked, so the garbage collector of a worker never writes to (and thereby copies) the pages holding them
+def when_ready(server):
+    gc.freeze()
+
+
+# Start the dataset reload watcher in each worker, since the master's threads don't survive the fork
+def post_fork(server, worker):
+    from ski_resorts_app import start_reload_watcher
+
+    start_reload_watcher()
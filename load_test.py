@@ -0,0 +1,186 @@
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from resorts_data import SOURCE_PATH, load_resorts
+
+# Headless HTTP load driver for a running instance of the app. It posts the same requests the browser sends to /_dash-update-component, with inputs drawn from the whole input space of each callback, and reports throughput and latency percentiles per callback.
+# Start the app under gunicorn first, then point the driver at it:
+#     gunicorn ski_resorts_app:server --workers 4 --bind 127.0.0.1:8050
+#     python load_test.py --url http://127.0.0.1:8050 --concurrency 16 --duration 30
+# The inputs are drawn from the dataset the app serves, read from the same RESORTS_SOURCE (or --source) as the app, so the countries and resorts it sends exist on the server.
+
+# The lift ticket price slider values and the resort options checklist values, as set in the layout
+PRICES = range(0, 151, 25)
+OPTION_COLUMNS = ["Snowparks", "Nightskiing", "Summer skiing"]
+
+
+# Fetch the callback definitions from the server, keyed on the id of their first input
+def fetch_dependencies(url):
+    with urllib.request.urlopen(f"{url}/_dash-dependencies") as response:
+        dependencies = json.load(response)
+    # Clientside callbacks run in the browser and have no endpoint on the server
+    return {
+        dependency["inputs"][0]["id"]: dependency
+        for dependency in dependencies
+        if not dependency.get("clientside_function")
+    }
+
+
+# Parse an output string such as "..title.children...resort-map.figure.." into the outputs Dash expects in the request body: a list for a callback with several outputs, a single dict otherwise
+def parse_outputs(output):
+    if not output.startswith(".."):
+        return dict(zip(("id", "property"), output.rsplit(".", 1)))
+    return [
+        dict(zip(("id", "property"), part.rsplit(".", 1)))
+        for part in output[2:-2].split("...")
+    ]
+
+
+# Every input value each callback can receive, keyed on the id of the callback's first input. The values come from a local copy of the dataset the app serves.
+def input_space(resorts):
+    # The metric dropdown offers the numeric columns except the ID, like the app does
+    metrics = [
+        column for column in resorts.select_dtypes("number").columns if column != "ID"
+    ]
+    return {
+        "price-select": [
+            [price, list(options)]
+            for price in PRICES
+            for count in range(len(OPTION_COLUMNS) + 1)
+            for options in itertools.combinations(OPTION_COLUMNS, count)
+        ],
+        "continent-select": [
+            [continent] for continent in resorts["Continent"].unique()
+        ],
+        "country-options": [
+            [country, metric]
+            for country in resorts["Country"].unique()
+            for metric in metrics
+        ],
+        "resort-graph": [
+            [{"points": [{"customdata": [name, country]}]}]
+            for name, country in resorts[["Resort", "Country"]]
+            .drop_duplicates()
+            .itertuples(index=False)
+        ],
+    }
+
+
+# Build the request body Dash's renderer would send for one callback and one set of input values
+def request_body(dependency, values):
+    # Inputs without a sampled value, such as the map's relayoutData before the user has zoomed, are sent as None like on the first render
+    inputs = [
+        dict(spec, value=value)
+        for spec, value in itertools.zip_longest(dependency["inputs"], values)
+    ]
+    return json.dumps(
+        {
+            "output": dependency["output"],
+            "outputs": parse_outputs(dependency["output"]),
+            "inputs": inputs,
+            "changedPropIds": [f"{spec['id']}.{spec['property']}" for spec in inputs],
+            "state": [],
+        }
+    ).encode()
+
+
+def post(url, body):
+    request = urllib.request.Request(
+        f"{url}/_dash-update-component",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            size = len(response.read())
+            status = response.status
+    except urllib.error.HTTPError as error:
+        # Dash answers 204 for PreventUpdate, which urllib treats as success; anything else is counted as an error
+        size, status = 0, error.code
+    except (OSError, http.client.HTTPException):
+        # A refused or dropped connection, e.g. while gunicorn restarts a worker, has no status and is counted as an error too
+        size, status = 0, None
+    return time.perf_counter() - start, status, size
+
+
+# Send requests from a number of threads until the duration is up. Each request picks a random callback and a random input for it.
+def run(url, concurrency, duration, seed=0, source=None):
+    dependencies = fetch_dependencies(url)
+    space = input_space(
+        load_resorts(source or os.environ.get("RESORTS_SOURCE", SOURCE_PATH))
+    )
+    requests = [
+        (name, request_body(dependencies[name], values))
+        for name, inputs in space.items()
+        if name in dependencies
+        for values in inputs
+    ]
+    results = []
+    results_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_number):
+        sampler = random.Random(seed + worker_number)
+        while time.perf_counter() < deadline:
+            name, body = sampler.choice(requests)
+            latency, status, size = post(url, body)
+            with results_lock:
+                results.append((name, latency, status, size))
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    return results
+
+
+def print_results(results, duration):
+    print(
+        f"{len(results)} requests in {duration}s ({len(results) / duration:.1f} req/s)"
+    )
+    print(
+        f"{'callback input':<20}{'requests':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean KiB':>10}"
+    )
+    for name in sorted({result[0] for result in results}):
+        rows = [result for result in results if result[0] == name]
+        latencies = np.array([row[1] for row in rows]) * 1000
+        errors = sum(1 for row in rows if row[2] is None or row[2] >= 400)
+        size = np.mean([row[3] for row in rows]) / 1024
+        print(
+            f"{name:<20}{len(rows):>10}{errors:>8}{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}{np.percentile(latencies, 99):>10.2f}{size:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Drive HTTP load against the Dash callbacks of a running ski resorts app."
+    )
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--source",
+        help="The resorts source the app was started with, RESORTS_SOURCE or resorts.xlsx by default",
+    )
+    args = parser.parse_args()
+    print_results(
+        run(
+            args.url.rstrip("/"),
+            args.concurrency,
+            args.duration,
+            args.seed,
+            args.source,
+        ),
+        args.duration,
+    )
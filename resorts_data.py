@@ -0,0 +1,492 @@
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+import time
+
+import pandas as pd
+import numpy as np
+
+# Default locations of the source spreadsheet and of the compiled snapshot directory. Both are relative to the working directory, like the original pd.read_excel call.
+SOURCE_PATH = "resorts.xlsx"
+SNAPSHOT_DIR = "resorts_snapshot"
+
+# Source files that are streamed through the ingest pipeline of resorts_ingest.py, instead of being read whole like the spreadsheet
+DUMP_SUFFIXES = (".csv", ".csv.gz", ".parquet")
+
+# The manifest describes the columns stored in a snapshot and the source file it was compiled from
+MANIFEST_NAME = "manifest.json"
+
+# Every build of a snapshot writes its columns into a new generation directory inside the snapshot directory, named with this prefix and the time of the build
+GENERATION_PREFIX = "generation-"
+
+# The country rank columns added by compute_ranks, in the order they appear on the Resort Report Card
+RANK_COLUMNS = [
+    "Elevation Rank",
+    "Lift Ticket Price Rank",
+    "Slope Count Rank",
+    "Cannon Count Rank",
+]
+
+# The Yes/No amenity columns, which are held as booleans in memory
+FLAG_COLUMNS = ["Child friendly", "Snowparks", "Nightskiing", "Summer skiing"]
+
+# The low-cardinality text columns, which are held as categoricals in memory
+CATEGORY_COLUMNS = ["Continent", "Country", "Season"]
+
+# Arrays placed in a shared memory arena start on multiples of this many bytes, which keeps them aligned for vectorized reads
+ARENA_ALIGNMENT = 64
+
+logger = logging.getLogger(__name__)
+
+
+# Assign four new columns that, for each country, ranks the resorts by elevation, price, slope, and snow cannon count
+def compute_ranks(df):
+    return (
+        df.assign(
+            country_elevation_rank=lambda x: x.groupby("Country", as_index=False)[
+                "Highest point"
+            ].rank(ascending=False),
+            country_price_rank=lambda x: x.groupby("Country", as_index=False)[
+                "Price"
+            ].rank(ascending=False),
+            country_slope_rank=lambda x: x.groupby("Country", as_index=False)[
+                "Total slopes"
+            ].rank(ascending=False),
+            country_cannon_rank=lambda x: x.groupby("Country", as_index=False)[
+                "Snow cannons"
+            ].rank(ascending=False),
+        )
+        # Rename the columns to be more human-readable
+        .rename(
+            columns={
+                "country_elevation_rank": "Elevation Rank",
+                "country_price_rank": "Lift Ticket Price Rank",
+                "country_cannon_rank": "Cannon Count Rank",
+                "country_slope_rank": "Slope Count Rank",
+            }
+        )
+    )
+
+
+# Read the source file without rank columns, in the form the spreadsheet is read in. Requires openpyxl for the spreadsheet
+def read_source(source=SOURCE_PATH):
+    if source.lower().endswith(DUMP_SUFFIXES):
+        # Imported here, since resorts_ingest builds on this module
+        from resorts_ingest import ingest_resorts
+
+        return expand_resorts(ingest_resorts(source, ranks=False))
+    return pd.read_excel(source)
+
+
+# Read the source file and compute the country ranks. CSV and Parquet dumps are ranked by the ingest pipeline, which keeps them in the compact form throughout
+def read_resorts(source=SOURCE_PATH):
+    if source.lower().endswith(DUMP_SUFFIXES):
+        from resorts_ingest import ingest_resorts
+
+        return ingest_resorts(source)
+    return compute_ranks(pd.read_excel(source))
+
+
+# Hash the contents of the source file, so that a snapshot can still be used when the file was only touched (e.g. by a fresh git checkout) but not changed
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Convert a dataframe as read from the source into the compact in-memory form: Yes/No flags become booleans, low-cardinality text becomes categoricals, integers are narrowed to the smallest type that holds their range,
+# and floats become float32 when that loses nothing (e.g. the ranks, which are whole or half numbers). Coordinates stay float64, since float32 would round them.
+# Columns that are already compact are passed through without being copied, so the columns of a snapshot stay memory-mapped.
+def compact_resorts(df):
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in FLAG_COLUMNS:
+            values = values.eq("Yes") if values.dtype != bool else values
+        elif column in CATEGORY_COLUMNS:
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype("category")
+        elif pd.api.types.is_integer_dtype(values):
+            narrow = pd.to_numeric(values, downcast="integer")
+            if narrow.dtype != values.dtype:
+                values = narrow
+        elif pd.api.types.is_float_dtype(values) and values.dtype != np.float32:
+            narrow = values.astype(np.float32)
+            if np.array_equal(narrow.to_numpy(), values.to_numpy(), equal_nan=True):
+                values = narrow
+        columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+# Convert a compact dataframe back into the form it was read in, so that it can be compared with and merged with freshly read data
+def expand_resorts(df):
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in FLAG_COLUMNS and values.dtype == bool:
+            values = pd.Series(np.where(values, "Yes", "No"), index=df.index)
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(values.cat.categories.dtype)
+        elif pd.api.types.is_integer_dtype(values):
+            values = values.astype(np.int64)
+        elif pd.api.types.is_float_dtype(values):
+            values = values.astype(np.float64)
+        columns[column] = values
+    return pd.DataFrame(columns)
+
+
+# Bytes a dataframe takes up in the form the source is read in, whatever form it is in now. Each column is expanded and measured on its own, so that the whole frame is never held in the source form at once.
+def source_memory_usage(df):
+    return df.index.memory_usage(deep=True) + sum(
+        expand_resorts(df[[column]]).memory_usage(deep=True, index=False).sum()
+        for column in df.columns
+    )
+
+
+# Compile the source file into a columnar snapshot: one .npy file per column with the ranks already computed, plus a manifest that records the column order, the categories of the categorical columns and the source file it came from.
+# The columns are stored in the compact in-memory form, so that compacting a loaded snapshot passes them through and they stay memory-mapped.
+# Running processes keep the columns of the snapshot they loaded mapped for as long as they use that version, and truncating a mapped file crashes them with SIGBUS. So a build never writes over existing files:
+# the columns go into a new generation directory, and only once they are complete is the manifest swapped to point at it. Readers that start during a build keep reading the previous generation.
+def build_snapshot(source=SOURCE_PATH, snapshot_dir=SNAPSHOT_DIR):
+    df = compact_resorts(read_resorts(source))
+    generation = f"{GENERATION_PREFIX}{time.time_ns():020d}"
+    os.makedirs(os.path.join(snapshot_dir, generation))
+    columns = []
+    for position, column in enumerate(df.columns):
+        file_name = f"{position:03d}.npy"
+        entry = {"name": column, "file": file_name}
+        # Low-cardinality text columns are stored as their integer category codes, with the categories in the manifest
+        if column in CATEGORY_COLUMNS:
+            values = df[column].cat.codes.to_numpy()
+            entry["categories"] = df[column].cat.categories.tolist()
+        else:
+            values = df[column].to_numpy()
+        # Other text columns are stored as fixed-width unicode arrays, since object arrays can't be memory-mapped
+        if values.dtype.kind not in "biuf":
+            values = values.astype(str)
+        np.save(os.path.join(snapshot_dir, generation, file_name), values)
+        columns.append(entry)
+    stat = os.stat(source)
+    manifest = {
+        "source": {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_digest(source),
+        },
+        "generation": generation,
+        "columns": columns,
+    }
+    # The manifest is written last and swapped in atomically, so a reader never sees a manifest for a half-written snapshot
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    previous = None
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f).get("generation")
+    except (OSError, ValueError):
+        pass
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    prune_generations(snapshot_dir, keep=[generation, previous])
+    return manifest
+
+
+# Delete the generations of a snapshot that are older than the ones to keep. The previous generation is kept, since a reader may have read the old manifest just before it was swapped.
+# Deleting files that processes still have mapped is safe: the pages stay readable until the last mapping goes away, unlike truncating the files.
+def prune_generations(snapshot_dir, keep):
+    oldest = min(generation for generation in keep if generation)
+    for entry in os.listdir(snapshot_dir):
+        if entry.startswith(GENERATION_PREFIX) and entry < oldest:
+            shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors=True)
+
+
+# Return the snapshot manifest if it was compiled from the current contents of the source file, otherwise None.
+# A matching mtime and size is trusted without reading the source. Only when those differ is the source hashed and compared.
+def fresh_manifest(source=SOURCE_PATH, snapshot_dir=SNAPSHOT_DIR):
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        stat = os.stat(source)
+    except (OSError, ValueError):
+        return None
+    recorded = manifest["source"]
+    if stat.st_size != recorded["size"]:
+        return None
+    if (
+        stat.st_mtime_ns != recorded["mtime_ns"]
+        and file_digest(source) != recorded["sha256"]
+    ):
+        return None
+    return manifest
+
+
+# Load the snapshot described by the manifest. Numeric columns stay memory-mapped, so every worker reading the same snapshot shares those pages through the OS page cache.
+def read_snapshot(manifest, snapshot_dir=SNAPSHOT_DIR):
+    data = {}
+    for column in manifest["columns"]:
+        # Snapshots built before generations were introduced have their columns at the top of the snapshot directory
+        values = np.load(
+            os.path.join(snapshot_dir, manifest.get("generation", ""), column["file"]),
+            mmap_mode="r",
+        )
+        if "categories" in column:
+            values = pd.Categorical.from_codes(values, column["categories"])
+        elif values.dtype.kind == "U":
+            values = values.astype(object)
+        data[column["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+# Load the resorts dataframe with its country ranks. The compiled snapshot is used when it is up to date with the source file, otherwise the source file is read directly.
+def load_resorts(source=SOURCE_PATH, snapshot_dir=SNAPSHOT_DIR):
+    manifest = fresh_manifest(source, snapshot_dir)
+    if manifest is None:
+        return read_resorts(source)
+    return read_snapshot(manifest, snapshot_dir)
+
+
+# Return the countries whose rows differ between two versions of the dataframe without rank columns, or None if every country has to be treated as changed.
+# The fast path needs the rows of the previous version to still sit at the same positions, in the same order, at the start of the new version. That holds for upserts, which edit rows in place and append new ones.
+def changed_countries(previous, df):
+    if list(previous.columns) != list(df.columns) or len(df) < len(previous):
+        return None
+    head = df.iloc[: len(previous)].reset_index(drop=True)
+    previous = previous.reset_index(drop=True)
+    if not head["ID"].equals(previous["ID"]):
+        return None
+    differs = ~((head == previous) | (head.isna() & previous.isna())).all(axis=1)
+    return (
+        set(previous.loc[differs, "Country"])
+        | set(head.loc[differs, "Country"])
+        | set(df["Country"].iloc[len(previous) :])
+    )
+
+
+# Rank a dataframe without rank columns, reusing the ranks of the previous version for every country that didn't change. Ranks are only ever compared within a country, so only the changed countries need to be ranked again.
+def rerank(df, previous, countries):
+    if countries is None:
+        return compute_ranks(df)
+    ranked = df.copy()
+    for column in RANK_COLUMNS:
+        values = np.full(len(df), np.nan)
+        values[: len(previous)] = previous[column].to_numpy()
+        ranked[column] = values
+    affected = df["Country"].isin(countries).to_numpy()
+    if affected.any():
+        ranked.loc[affected, RANK_COLUMNS] = compute_ranks(df.loc[affected])[
+            RANK_COLUMNS
+        ].to_numpy()
+    return ranked
+
+
+# Replace the rows of df whose ID appears in rows, keeping their position, and append the rows with new IDs at the end. The IDs in df must be unique.
+def apply_upserts(df, rows):
+    rows = rows.drop_duplicates("ID", keep="last")
+    positions = pd.Index(df["ID"]).get_indexer(rows["ID"])
+    existing = positions >= 0
+    updated = df.copy()
+    for column in df.columns:
+        values = updated[column].to_numpy().copy()
+        values[positions[existing]] = rows[column].to_numpy()[existing]
+        updated[column] = values
+    return pd.concat([updated, rows.loc[~existing, df.columns]], ignore_index=True)
+
+
+# One version of the resorts dataset. A version is never modified after it is published, so a callback that reads dataset.current once sees a consistent dataframe and indexes for its whole run.
+# The app's derived indexes are stored as attributes on the version, which ties them to the version number instead of needing to be flushed on reload.
+class DatasetVersion:
+    def __init__(self, number, resorts, changed_countries):
+        self.number = number
+        self.resorts = resorts
+        # The countries whose rows changed since the previous version, or None when every country has to be treated as changed
+        self.changed_countries = changed_countries
+        # Bytes used by the dataframe in the form the source is read in, and in the compact form
+        self.memory_usage = None
+
+
+# Holds the current version of the resorts dataset and publishes new versions when the source file changes or rows are upserted.
+# on_version(version, previous) is called on every new version before it is published, to build the derived indexes on it. previous is None for the first version.
+class ResortDataset:
+    def __init__(self, source=SOURCE_PATH, snapshot_dir=SNAPSHOT_DIR, on_version=None):
+        self.source = source
+        self.snapshot_dir = snapshot_dir
+        self.on_version = on_version
+        # Writers are serialized by the lock. Readers never take it, they just read self.current, which is swapped in with a single assignment.
+        self._lock = threading.Lock()
+        self._source_mtime = os.stat(source).st_mtime_ns
+        self.current = None
+        self._publish(load_resorts(source, snapshot_dir), None)
+
+    # Convert the ranked dataframe to the compact form and publish it as the next version
+    def _publish(self, resorts, countries):
+        previous = self.current
+        compact = compact_resorts(resorts)
+        version = DatasetVersion(
+            previous.number + 1 if previous else 1, compact, countries
+        )
+        # The dataframe may already be compact, e.g. when it comes from the snapshot, so "before" is measured on the source form of it
+        version.memory_usage = (
+            source_memory_usage(resorts),
+            compact.memory_usage(deep=True).sum(),
+        )
+        logger.info(
+            "Dataset version %d: %d resorts, %.2f MiB before and %.2f MiB after compaction",
+            version.number,
+            len(compact),
+            version.memory_usage[0] / 2**20,
+            version.memory_usage[1] / 2**20,
+        )
+        if self.on_version is not None:
+            self.on_version(version, previous)
+        self.current = version
+        return version
+
+    # The current version without rank columns, expanded back into the form the source is read in
+    def _base(self):
+        return expand_resorts(self.current.resorts.drop(columns=RANK_COLUMNS))
+
+    # Publish a whole new dataframe without rank columns as a new version, ranking every country from scratch
+    def replace(self, df):
+        with self._lock:
+            return self._publish(compute_ranks(df), None)
+
+    # Publish a new version with the given rows inserted or updated, matched on the ID column. Only the countries of those rows are ranked again.
+    def upsert(self, rows):
+        with self._lock:
+            previous = self._base()
+            df = apply_upserts(previous, rows)
+            countries = changed_countries(previous, df)
+            return self._publish(rerank(df, self.current.resorts, countries), countries)
+
+    # Read the source file again and publish it as a new version. The compiled snapshot is used when it is up to date, and only the countries that changed are ranked again.
+    def reload(self):
+        with self._lock:
+            mtime = os.stat(self.source).st_mtime_ns
+            manifest = fresh_manifest(self.source, self.snapshot_dir)
+            if manifest is None:
+                df = read_source(self.source)
+            else:
+                df = expand_resorts(
+                    read_snapshot(manifest, self.snapshot_dir).drop(
+                        columns=RANK_COLUMNS
+                    )
+                )
+            countries = changed_countries(self._base(), df)
+            version = self._publish(
+                rerank(df, self.current.resorts, countries), countries
+            )
+            self._source_mtime = mtime
+            return version
+
+    # Start a daemon thread that reloads the dataset whenever the modification time of the source file changes. A failed reload (e.g. of a half-written file) is logged and retried on the next poll.
+    def watch(self, interval=5.0):
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    if os.stat(self.source).st_mtime_ns != self._source_mtime:
+                        self.reload()
+                except Exception:
+                    logger.exception("Reloading %s failed", self.source)
+
+        thread = threading.Thread(target=poll, name="resorts-watcher", daemon=True)
+        thread.start()
+        return thread
+
+
+# Copy arrays into one anonymous shared memory mapping and return read-only views of them. The pages of a shared mapping are shared with every process forked afterwards and are never copied on write,
+# unlike the Python heap, where reference counting and garbage collection write to the pages of every object a worker touches. Object and empty arrays are returned as they are.
+def share_arrays(arrays):
+    offsets, total = [], 0
+    for array in arrays:
+        total = -(-total // ARENA_ALIGNMENT) * ARENA_ALIGNMENT
+        offsets.append(total)
+        total += array.nbytes
+    if total == 0:
+        return list(arrays)
+    arena = mmap.mmap(-1, total)
+    shared = []
+    for array, offset in zip(arrays, offsets):
+        if array.dtype.hasobject or array.size == 0:
+            shared.append(array)
+            continue
+        view = np.frombuffer(
+            arena, dtype=array.dtype, count=array.size, offset=offset
+        ).reshape(array.shape)
+        view[...] = array
+        view.flags.writeable = False
+        shared.append(view)
+    return shared
+
+
+# Return a copy of a tree of dicts, lists and tuples in which every NumPy array has been moved into shared memory
+def share_tree(tree):
+    arrays = []
+
+    def collect(node):
+        if isinstance(node, np.ndarray):
+            arrays.append(node)
+        elif isinstance(node, dict):
+            for value in node.values():
+                collect(value)
+        elif isinstance(node, (list, tuple)):
+            for value in node:
+                collect(value)
+
+    def rebuild(node):
+        if isinstance(node, np.ndarray):
+            return next(shared)
+        if isinstance(node, dict):
+            return {key: rebuild(value) for key, value in node.items()}
+        if isinstance(node, (list, tuple)):
+            return type(node)(rebuild(value) for value in node)
+        return node
+
+    collect(tree)
+    shared = iter(share_arrays(arrays))
+    return rebuild(tree)
+
+
+# Return a copy of a compact dataframe whose numeric and boolean columns and categorical codes live in shared memory. Text columns are kept as they are.
+def share_dataframe(df):
+    arrays = []
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays.append(values.cat.codes.to_numpy())
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            arrays.append(values.to_numpy())
+    shared = iter(share_arrays(arrays))
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[column] = pd.Categorical.from_codes(
+                next(shared), dtype=values.dtype
+            )
+        elif isinstance(values.dtype, np.dtype) and values.dtype.kind in "biuf":
+            columns[column] = next(shared)
+        else:
+            columns[column] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+# Build step: python resorts_data.py [--source resorts.xlsx] [--snapshot-dir resorts_snapshot]. The source can also be a CSV or Parquet dump.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the resorts spreadsheet or a CSV or Parquet dump into a columnar snapshot for the app to load at startup."
+    )
+    parser.add_argument("--source", default=SOURCE_PATH)
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    manifest = build_snapshot(args.source, args.snapshot_dir)
+    print(
+        f"Wrote {len(manifest['columns'])} columns from {args.source} to {args.snapshot_dir}"
+    )
@@ -0,0 +1,244 @@
+import logging
+
+import pandas as pd
+import numpy as np
+
+from resorts_data import CATEGORY_COLUMNS, FLAG_COLUMNS, RANK_COLUMNS
+
+# Streams CSV and Parquet dumps of resorts into the dataframe the app expects, for datasets too large to read whole like the spreadsheet.
+# The dump is read a chunk of rows at a time. Every chunk is validated and normalized to the schema below and converted straight to the compact in-memory form, so the raw text of the dump is never held at once.
+# Resorts that appear more than once are deduplicated and the country ranks are computed one column at a time. Dumps go through here whenever they are passed as the source to resorts_data.py:
+#     python resorts_data.py --source resorts_1m.parquet
+#     RESORTS_SOURCE=resorts_1m.parquet gunicorn ski_resorts_app:server
+
+# Rows read from the dump at a time
+CHUNK_ROWS = 100_000
+
+# The columns of the dataset in the order the app expects them, and the kind of values each one holds
+SCHEMA = [
+    ("ID", "integer"),
+    ("Resort", "text"),
+    ("Latitude", "float"),
+    ("Longitude", "float"),
+    ("Country", "category"),
+    ("Continent", "category"),
+    ("Price", "integer"),
+    ("Season", "category"),
+    ("Highest point", "integer"),
+    ("Lowest point", "integer"),
+    ("Beginner slopes", "integer"),
+    ("Intermediate slopes", "integer"),
+    ("Difficult slopes", "integer"),
+    ("Total slopes", "integer"),
+    ("Longest run", "integer"),
+    ("Snow cannons", "integer"),
+    ("Surface lifts", "integer"),
+    ("Chair lifts", "integer"),
+    ("Gondola lifts", "integer"),
+    ("Total lifts", "integer"),
+    ("Lift capacity", "integer"),
+] + [(column, "flag") for column in FLAG_COLUMNS]
+
+# Values of columns that may be missing from the dump, or empty in some of its rows. The ID is numbered from 1 when the dump has none. Every other column is required.
+DEFAULTS = {"Season": "Unknown"}
+
+# Bounds of the numeric columns. A row with a value outside of them is rejected.
+VALUE_RANGES = {
+    "Latitude": (-90, 90),
+    "Longitude": (-180, 180),
+    "Price": (0, None),
+    "Beginner slopes": (0, None),
+    "Intermediate slopes": (0, None),
+    "Difficult slopes": (0, None),
+    "Total slopes": (0, None),
+    "Longest run": (0, None),
+    "Snow cannons": (0, None),
+    "Surface lifts": (0, None),
+    "Chair lifts": (0, None),
+    "Gondola lifts": (0, None),
+    "Total lifts": (0, None),
+    "Lift capacity": (0, None),
+}
+
+# The spellings accepted for the Yes/No amenity flags, after trimming and lower-casing. An empty flag counts as No.
+YES_VALUES = ["yes", "y", "true", "t", "1", "1.0"]
+NO_VALUES = ["no", "n", "false", "f", "0", "0.0"]
+
+# The column each country rank is computed from, as in compute_ranks
+RANKED_COLUMNS = dict(
+    zip(RANK_COLUMNS, ["Highest point", "Price", "Total slopes", "Snow cannons"])
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Read the dump a chunk of rows at a time. Parquet requires pyarrow
+def read_chunks(source, chunk_rows=CHUNK_ROWS):
+    if source.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_rows)
+
+
+# Fold a column name to lower case with single spaces, so that e.g. "total_slopes" and "Total Slopes" both match the "Total slopes" column of the schema
+def fold_name(name):
+    return " ".join(str(name).replace("_", " ").split()).casefold()
+
+
+# Rename the columns of a chunk to the names of the schema and drop the columns the app doesn't use. Raises ValueError when a required column is missing.
+def match_columns(chunk):
+    names = {fold_name(name): name for name, kind in SCHEMA}
+    chunk = chunk.rename(columns=lambda column: names.get(fold_name(column), column))
+    missing = [
+        name
+        for name, kind in SCHEMA
+        if name not in chunk.columns and name != "ID" and name not in DEFAULTS
+    ]
+    if missing:
+        raise ValueError(f"The dump has no {', '.join(missing)} column(s)")
+    return chunk[[name for name, kind in SCHEMA if name in chunk.columns]]
+
+
+# Trim text and collapse runs of whitespace, returning None for empty values
+def clean_text(values):
+    values = values.astype("string").str.strip().str.replace(r"\s+", " ", regex=True)
+    return values.mask(values == "")
+
+
+# Normalize one column of a chunk to the compact form of its kind. Returns the values and a mask of the rows whose value is invalid.
+def normalize_column(name, kind, values):
+    if kind in ("text", "category"):
+        values = clean_text(values)
+        if name in DEFAULTS:
+            values = values.fillna(DEFAULTS[name])
+        invalid = values.isna().to_numpy()
+        values = values.fillna("")
+        if kind == "category":
+            return pd.Categorical(values.astype(object)), invalid
+        # Text stays in pandas' string array, which packs the characters into one buffer instead of holding a Python object per value
+        return values.array, invalid
+    if kind == "flag":
+        if values.dtype == bool:
+            return values.to_numpy(), np.zeros(len(values), dtype=bool)
+        folded = clean_text(values).str.lower()
+        yes = folded.isin(YES_VALUES).to_numpy()
+        no = folded.isin(NO_VALUES).to_numpy() | folded.isna().to_numpy()
+        return yes, ~(yes | no)
+    numbers = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    invalid = np.isnan(numbers)
+    low, high = VALUE_RANGES.get(name, (None, None))
+    if low is not None:
+        invalid |= numbers < low
+    if high is not None:
+        invalid |= numbers > high
+    if kind == "float":
+        return numbers, invalid
+    invalid |= numbers != np.floor(numbers)
+    # Each chunk is narrowed on its own, and concatenating the chunks widens them to the type that fits all of them
+    whole = np.where(invalid, 0, numbers).astype(np.int64)
+    return pd.to_numeric(whole, downcast="integer"), invalid
+
+
+# A 64-bit hash of the identity of each resort: its name and country, regardless of case and spacing. Two rows with the same hash are the same resort.
+def resort_keys(resorts, countries):
+    return pd.util.hash_array(
+        (
+            pd.Series(resorts).str.casefold()
+            + "\x1f"
+            + pd.Series(np.asarray(countries, dtype=object)).str.casefold()
+        ).to_numpy(dtype=object)
+    )
+
+
+# Positions of the rows to keep: the last occurrence of every resort, placed where the resort first appeared, like an upsert
+def deduplicated_rows(keys):
+    _, first = np.unique(keys, return_index=True)
+    _, last_reversed = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last_reversed
+    return last[np.argsort(first, kind="stable")]
+
+
+# Rank one column within each country the way compute_ranks does, from the category codes of the countries
+def rank_by_country(countries, values):
+    return (
+        pd.Series(values)
+        .groupby(countries.codes)
+        .rank(ascending=False)
+        .to_numpy(dtype=np.float64)
+    )
+
+
+# Stream a CSV or Parquet dump into a compact dataframe in the column order of the schema, with the country ranks unless ranks is False.
+# Rows with a missing or invalid value are rejected and counted, and a summary of the rejected and duplicate rows is logged.
+def ingest_resorts(source, chunk_rows=CHUNK_ROWS, ranks=True):
+    chunks = {name: [] for name, kind in SCHEMA}
+    keys = []
+    has_ids = True
+    read, rejected = 0, {}
+    for chunk in read_chunks(source, chunk_rows):
+        chunk = match_columns(chunk)
+        has_ids = has_ids and "ID" in chunk.columns
+        read += len(chunk)
+        columns = {}
+        invalid = np.zeros(len(chunk), dtype=bool)
+        for name, kind in SCHEMA:
+            if name not in chunk.columns:
+                if name in DEFAULTS:
+                    chunk[name] = DEFAULTS[name]
+                else:
+                    continue
+            columns[name], column_invalid = normalize_column(name, kind, chunk[name])
+            if column_invalid.any():
+                rejected[name] = rejected.get(name, 0) + int(column_invalid.sum())
+            invalid |= column_invalid
+        valid = ~invalid
+        for name, values in columns.items():
+            chunks[name].append(values[valid])
+        keys.append(resort_keys(columns["Resort"][valid], columns["Country"][valid]))
+    if not keys:
+        raise ValueError(f"{source} has no rows")
+
+    keys = np.concatenate(keys)
+    rows = deduplicated_rows(keys)
+    # Each column is assembled and deduplicated in turn, and its chunks are released before the next one
+    data = {}
+    for name, kind in SCHEMA:
+        parts = chunks.pop(name)
+        if not parts:
+            continue
+        if kind == "category":
+            values = pd.api.types.union_categoricals(parts)
+        elif kind == "text":
+            values = (
+                pd.concat(map(pd.Series, parts), ignore_index=True).astype(str).array
+            )
+        else:
+            values = np.concatenate(parts)
+        data[name] = values[rows]
+    if not has_ids or pd.Index(data["ID"]).has_duplicates:
+        if has_ids:
+            logger.warning(
+                "%s: IDs are missing or shared by different resorts, numbering the resorts from 1",
+                source,
+            )
+        data["ID"] = pd.to_numeric(np.arange(1, len(rows) + 1), downcast="integer")
+    df = pd.DataFrame({name: data[name] for name, kind in SCHEMA}, copy=False)
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].cat.remove_unused_categories()
+    if ranks:
+        for column, ranked in RANKED_COLUMNS.items():
+            df[column] = rank_by_country(df["Country"].cat, df[ranked].to_numpy())
+
+    logger.info(
+        "%s: read %d rows, rejected %d with invalid values (%s), dropped %d duplicate resorts, kept %d",
+        source,
+        read,
+        read - len(keys),
+        ", ".join(f"{name}: {count}" for name, count in rejected.items()) or "none",
+        len(keys) - len(rows),
+        len(df),
+    )
+    return df
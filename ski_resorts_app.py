@@ -1,13 +1,29 @@
-from dash import Dash, dcc, html, dash_table
+from dash import Dash, Patch, dcc, html, dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
 from dash_bootstrap_templates import load_figure_template
 
 import plotly.express as px
+import plotly.io as pio
 import pandas as pd
 import numpy as np
 
+import functools
+import itertools
+import json
+import os
+
+from callback_metrics import install_metrics, instrumented, phase
+from figure_executor import FigureCache, FigureExecutor
+from resorts_data import (
+    FLAG_COLUMNS,
+    RANK_COLUMNS,
+    ResortDataset,
+    share_dataframe,
+    share_tree,
+)
+
 # URL to apply bootstrap themes to dcc components
 dbc_css = "https://cdn.jsdelivr.net/gh/AnnMarieW/dash-bootstrap-templates/dbc.css"
 
@@ -22,332 +38,846 @@ app = Dash(
 )
 server = app.server
 
-# Import the dataframe and assign four new columns that, for each country, ranks the resorts by elevation, price, slope, and snow cannon count
-# Modified to read .xlsx files. Requires openpyxl
-resorts = (
-    pd.read_excel("resorts.xlsx").assign(
-        country_elevation_rank=lambda x: x.groupby("Country", as_index=False)[
-            "Highest point"
-        ].rank(ascending=False),
-        country_price_rank=lambda x: x.groupby("Country", as_index=False)["Price"].rank(
-            ascending=False
-        ),
-        country_slope_rank=lambda x: x.groupby("Country", as_index=False)[
-            "Total slopes"
-        ].rank(ascending=False),
-        country_cannon_rank=lambda x: x.groupby("Country", as_index=False)[
-            "Snow cannons"
-        ].rank(ascending=False),
-    )
-    # Rename the columns to be more human-readable
-    .rename(
-        columns={
-            "country_elevation_rank": "Elevation Rank",
-            "country_price_rank": "Lift Ticket Price Rank",
-            "country_cannon_rank": "Cannon Count Rank",
-            "country_slope_rank": "Slope Count Rank",
+# Serialize callback responses with orjson, which writes the NumPy arrays of the cached traces without converting them to lists first. Requires orjson
+pio.json.config.default_engine = "orjson"
+
+# Figures are built through this executor, so concurrent identical requests wait for one build. Set FIGURE_THREADS to build them on a pool of that many threads.
+# It pays off with threaded gunicorn workers (gunicorn_preload.conf.py uses gthread), where several requests of one worker run at once.
+figure_executor = FigureExecutor(int(os.environ.get("FIGURE_THREADS", 0)))
+
+# The Yes/No amenity columns that can be selected from the Resort Finder checklist. The position of each column in this list is its bit in the filter index below.
+OPTION_COLUMNS = ["Snowparks", "Nightskiing", "Summer skiing"]
+
+# The range and step of the lift ticket price slider. The slider only ever sends one of these few values, which is what makes the figures for the map cacheable.
+PRICE_MIN = 0
+PRICE_MAX = 150
+PRICE_STEP = 25
+
+# The columns shown when hovering over a resort on the Resort Finder map
+HOVER_COLUMNS = ["Resort", "Price", "Snowparks", "Nightskiing", "Summer skiing"]
+
+# Maximum number of Resort Finder figures held in the cache. The slider and the checklist only produce 7 x 8 = 56 distinct combinations, so this holds all of them.
+RESORTMAP_CACHE_SIZE = 64
+
+# Maximum number of bar graphs of the top resorts held in the cache. Each one holds at most 10 resorts, and the real dataset has 38 countries x 20 metrics = 760 of them.
+RESORT_GRAPH_CACHE_SIZE = 1024
+
+# The Resort Finder figures, keyed on the dataset version number, price and options, the bar graphs, keyed on the version number, country and metric, and the resort columns shipped to the browser in clientside filtering mode, keyed on the version number.
+# They are keyed on the number rather than the version itself, so that a superseded version and its dataframe are freed as soon as no request uses it any more.
+resortmap_cache = FigureCache(RESORTMAP_CACHE_SIZE)
+resort_graph_cache = FigureCache(RESORT_GRAPH_CACHE_SIZE)
+clientside_columns_cache = FigureCache(2)
+
+
+# Build the filter index for the Resort Finder map once at load time, so that the map callback never has to rescan the dataframe.
+# The rows are put in ascending price order, which turns the price cutoff into a binary search, and the Yes/No amenity columns are packed into one bitmask per row.
+def build_filter_index(df):
+    prices = df["Price"].to_numpy(dtype=np.float64)
+    order = np.argsort(prices, kind="stable")
+    option_bits = np.zeros(len(df), dtype=np.uint8)
+    for bit, column in enumerate(OPTION_COLUMNS):
+        option_bits |= df[column].to_numpy(dtype=bool)[order].astype(np.uint8) << bit
+    return {"order": order, "prices": prices[order], "option_bits": option_bits}
+
+
+# Return the positional row numbers of the resorts cheaper than the price that have every one of the selected options, in their original dataframe order
+def filter_rows(index, price, options):
+    # Every row before the cutoff has a Price strictly lower than the selected price
+    cutoff = np.searchsorted(index["prices"], price, side="left")
+    required = 0
+    for option in options or []:
+        required |= 1 << OPTION_COLUMNS.index(option)
+    option_bits = index["option_bits"][:cutoff]
+    rows = index["order"][:cutoff][(option_bits & required) == required]
+    # Restore the dataframe order so that the figure is drawn exactly as it was before the index existed
+    rows.sort()
+    return rows
+
+
+# Build the index behind the Resort Report Card: a dict from (country, resort name) to row number, and the four rank columns stacked into one array, so a hover is answered by a single lookup.
+# Ranks are only meaningful within a country, and resorts in different countries can share a name, so the index is keyed on both. If a name appears more than once within a country, it resolves to its first row there.
+def build_rank_index(df):
+    rows = {}
+    for row, key in enumerate(zip(df["Country"].tolist(), df["Resort"].tolist())):
+        rows.setdefault(key, row)
+    return {"rows": rows, "ranks": df[RANK_COLUMNS].to_numpy(dtype=np.float64)}
+
+
+# Build the metadata catalog of a dataset version, which the dropdowns and the top-resorts table read instead of scanning the dataframe:
+#     continents: every continent, in order of first appearance, mapped to its countries in alphabetical order
+#     metrics: the columns resorts can be ranked by, which are the numeric columns except for the ID column where the rows are arbitrarily numbered
+#     country_order and country_ranges: the row numbers grouped by country, and the (start, stop) range of each country's rows in them
+def build_catalog(df):
+    countries = df["Country"].cat
+    codes = countries.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(countries.categories) + 1))
+    continents = {}
+    pairs = df[["Continent", "Country"]].drop_duplicates()
+    for continent, country in zip(pairs["Continent"], pairs["Country"]):
+        continents.setdefault(continent, []).append(country)
+    return {
+        "continents": {
+            continent: sorted(names) for continent, names in continents.items()
+        },
+        "metrics": [
+            column for column in df.select_dtypes("number").columns if column != "ID"
+        ],
+        "country_order": order,
+        "country_ranges": {
+            country: (int(start), int(stop))
+            for country, start, stop in zip(
+                countries.categories.tolist(), bounds[:-1], bounds[1:]
+            )
+            if stop > start
+        },
+    }
+
+
+# Return the row numbers of a country from the catalog in dataframe order, or None for a country without resorts
+def country_rows(catalog, country):
+    bounds = catalog["country_ranges"].get(country)
+    if bounds is None:
+        return None
+    return catalog["country_order"][bounds[0] : bounds[1]]
+
+
+# Number of resorts shown in the Resort Rankings bar graph
+TOP_N = 10
+
+
+# Return the row numbers of the top n resorts by one metric among the given rows, highest value first. Ties are broken by dataframe order so the result is deterministic.
+# np.partition finds the n-th highest value without sorting the whole country; only the rows at or above it are sorted.
+def top_rows(rows, values, n):
+    if len(values) > n:
+        threshold = -np.partition(-values, n - 1)[n - 1]
+        keep = ~(values < threshold)
+        rows, values = rows[keep], values[keep]
+    return rows[np.lexsort((rows, -values))][:n]
+
+
+# Compute the top resorts of every metric for the given countries and store them in the top-resorts table, a dict of country -> metric -> row numbers.
+# Passing only some countries refreshes just those entries, so a reload that touched a few countries doesn't redo the rest.
+def refresh_top_resorts(table, df, catalog, countries, n=TOP_N):
+    # The values are compared as float64, since negating the narrow integer columns of the compact dataframe could overflow
+    metric_values = {
+        metric: df[metric].to_numpy(dtype=np.float64) for metric in catalog["metrics"]
+    }
+    for country in countries:
+        rows = country_rows(catalog, country)
+        if rows is None:
+            table.pop(country, None)
+            continue
+        table[country] = {
+            metric: top_rows(rows, values[rows], n)
+            for metric, values in metric_values.items()
+        }
+    return table
+
+
+# Levels of the spatial grid pyramid used by the level-of-detail map. At level L the world is divided into 2**L x 2**L cells of equal size in degrees.
+GRID_LEVELS = 11
+
+# A grid level this much finer than the map zoom gives cells of about an eighth of a map tile (32 px), which is about the radius of the density heatmap, so binning doesn't visibly change the map
+GRID_LEVEL_OFFSET = 3
+
+# The level-of-detail map shows raw resorts instead of grid cells once it is zoomed in at least this far, or once no more than RAW_POINT_LIMIT resorts are in view
+RAW_ZOOM = 7
+RAW_POINT_LIMIT = 2000
+
+# The view of the Resort Finder map before the user moves it
+MAP_CENTER = {"lat": 44.5, "lon": -103.5}
+MAP_ZOOM = 3.5
+
+
+# Build the grid pyramid for the level-of-detail map once per dataset version. For every level, each resort gets the number of its grid cell, numbered densely over the cells that contain at least one resort.
+def build_grid_pyramid(df):
+    lat = df["Latitude"].to_numpy(dtype=np.float64)
+    lon = df["Longitude"].to_numpy(dtype=np.float64)
+    levels = []
+    for level in range(GRID_LEVELS):
+        side = 2**level
+        x = np.clip(((lon + 180) / 360 * side).astype(np.int64), 0, side - 1)
+        y = np.clip(((lat + 90) / 180 * side).astype(np.int64), 0, side - 1)
+        cells, cell_of_row = np.unique(y * side + x, return_inverse=True)
+        levels.append({"cell_of_row": cell_of_row, "cell_count": len(cells)})
+    return levels
+
+
+# Read the zoom and the visible bounds (west, south, east, north) of the map from its relayoutData. The bounds are None until the user has moved the map.
+def map_view(relayout_data):
+    relayout_data = relayout_data or {}
+    zoom = relayout_data.get("mapbox.zoom", MAP_ZOOM)
+    corners = relayout_data.get("mapbox._derived", {}).get("coordinates")
+    if not corners:
+        return zoom, None
+    lons = [corner[0] for corner in corners]
+    lats = [corner[1] for corner in corners]
+    return zoom, (min(lons), min(lats), max(lons), max(lats))
+
+
+# Keep the rows whose resort lies within the bounds, with a margin of a quarter of the view on every side so that heat just outside the edge still shows when panning
+def rows_in_view(version, rows, bounds):
+    if bounds is None:
+        return rows
+    west, south, east, north = bounds
+    margin_lon = (east - west) / 4
+    margin_lat = (north - south) / 4
+    lat = version.latitude[rows]
+    keep = (lat >= south - margin_lat) & (lat <= north + margin_lat)
+    width = east - west + 2 * margin_lon
+    # Longitudes are compared modulo 360, since a panned map can report bounds past the antimeridian
+    if width < 360:
+        keep &= (version.longitude[rows] - (west - margin_lon)) % 360 <= width
+    return rows[keep]
+
+
+# Combine the resorts in the given rows into the grid cells of one level. Each cell is placed at the mean position of its resorts and weighted by their total slopes.
+def aggregate_rows(version, rows, level):
+    grid = version.grid_pyramid[level]
+    cells = grid["cell_of_row"][rows]
+    count = np.bincount(cells, minlength=grid["cell_count"])
+    present = count > 0
+
+    def cell_sum(values):
+        return np.bincount(cells, weights=values[rows], minlength=grid["cell_count"])[
+            present
+        ]
+
+    return pd.DataFrame(
+        {
+            "Latitude": cell_sum(version.latitude) / count[present],
+            "Longitude": cell_sum(version.longitude) / count[present],
+            "Total slopes": cell_sum(version.total_slopes),
+            "Resorts": count[present],
         }
     )
+
+
+# Show the boolean amenity columns of the compact dataframe as Yes/No again, the way they appear in the source data
+def with_yes_no(df, columns):
+    flags = [column for column in columns if column in FLAG_COLUMNS]
+    return df.assign(**{column: np.where(df[column], "Yes", "No") for column in flags})
+
+
+# The figures are built from templates rather than by calling Plotly Express for every request, since its argument checking and data wrangling cost more than the filtering itself.
+# Each template is made once by running Plotly Express on an empty frame, so it carries exactly the theme, layout, hovertemplate and trace settings Plotly Express would produce, and requests only fill in the trace arrays.
+# The templates are plain dicts shared by every request, so they are copied rather than modified.
+
+
+# The template of the density_mapbox figure of the Resort Finder map, for a tuple of hover columns
+@functools.lru_cache(maxsize=None)
+def density_map_template(hover_data):
+    fig = px.density_mapbox(
+        pd.DataFrame(columns=["Latitude", "Longitude", "Total slopes", *hover_data]),
+        lat="Latitude",
+        lon="Longitude",
+        z="Total slopes",
+        center=MAP_CENTER,
+        mapbox_style="open-street-map",
+        zoom=MAP_ZOOM,
+        color_continuous_scale="Plotly3",
+        hover_data=list(hover_data),
+        width=1000,
+        height=800,
+    )
+    return json.loads(fig.to_json())
+
+
+# Construct the density_mapbox trace of the Resort Finder map for the given rows
+def density_map_trace(df, hover_data):
+    template = density_map_template(tuple(hover_data))
+    return dict(
+        template["data"][0],
+        lat=df["Latitude"].to_numpy(),
+        lon=df["Longitude"].to_numpy(),
+        z=df["Total slopes"].to_numpy(),
+        customdata=with_yes_no(df[hover_data], hover_data).to_numpy(),
+    )
+
+
+# Construct the density_mapbox figure of the Resort Finder map
+def density_map_figure(df, hover_data):
+    return {
+        "data": [density_map_trace(df, hover_data)],
+        "layout": density_map_template(tuple(hover_data))["layout"],
+    }
+
+
+# The template of the bar graph of the top resorts by a metric, with one entry per metric
+@functools.lru_cache(maxsize=64)
+def bar_template(metric):
+    fig = px.bar(
+        pd.DataFrame(columns=["Resort", "Country", metric]),
+        x="Resort",
+        y=metric,
+        height=750,
+        # In addition to building the graph, we also want to pass the Resort name and its country as custom_data back to the output. This will allow us to "select" the resort when we hover over that resort's data in our bar graph
+        custom_data=["Resort", "Country"],
+    )
+    return json.loads(fig.to_json())
+
+
+# Create the dynamic title that will be passed back to the title element
+def resortmap_title(price):
+    return f"Ski Resorts by Total Slopes with a Lift Ticket Price of Less Than ${price}"
+
+
+# Put the selected checklist options into one canonical order, so that the same selection made in a different click order hits the same cache entry
+def canonical_options(options):
+    return tuple(column for column in OPTION_COLUMNS if column in (options or []))
+
+
+# Make a trace safe to cache and share between requests: its NumPy arrays are made read-only, and arrays of Python objects (the text and mixed columns) become tuples.
+# A cached trace is sent as it is, without being copied or decoded, and orjson serializes the read-only arrays and the tuples directly.
+def frozen_trace(trace):
+    frozen = dict(trace)
+    for key, value in trace.items():
+        if isinstance(value, np.ndarray):
+            if value.dtype == object:
+                frozen[key] = tuple(
+                    tuple(row) if value.ndim > 1 else row for row in value.tolist()
+                )
+            else:
+                value.flags.writeable = False
+    return frozen
+
+
+# Build the title and the density_mapbox trace for one dataset version, price and set of options. The results are kept in resortmap_cache, since the inputs can only take a handful of values.
+# Only the trace is cached, since the layout is the same for every entry. It is frozen, so cached entries can be returned directly and can never be mutated by a caller. Hits and misses can be read from resortmap_cache.info().
+# Entries of an older dataset version are never hit again once a new version is published, and they age out of the cache on their own.
+def build_resortmap(version, price, options):
+    # Look up the resorts under the selected price that have all of the selected options in the precomputed filter index, then take just those rows from the dataframe
+    with phase("filter"):
+        df = version.resorts.iloc[filter_rows(version.filter_index, price, options)]
+
+    with phase("figure"):
+        trace = frozen_trace(density_map_trace(df, HOVER_COLUMNS))
+    return resortmap_title(price), trace
+
+
+# Return the title and trace from the figure cache. Only a miss goes through the figure executor, so cache hits never wait for a pool thread, while concurrent misses for the same figure share one build.
+def cached_resortmap(version, price, options):
+    return figure_executor.cached(
+        resortmap_cache,
+        (version.number, price, options),
+        build_resortmap,
+        version,
+        price,
+        options,
+    )
+
+
+# Fill the figure cache with every combination the slider and the checklist can produce, so that the map callback never has to build a figure while serving requests.
+# The figures are built inline rather than on the figure executor's pool, since under gunicorn --preload this runs in the master, which must not start threads before the workers are forked.
+def prewarm_resortmap_cache(version):
+    for price in range(PRICE_MIN, PRICE_MAX + 1, PRICE_STEP):
+        for count in range(len(OPTION_COLUMNS) + 1):
+            for options in itertools.combinations(OPTION_COLUMNS, count):
+                resortmap_cache.get_or_build(
+                    (version.number, price, options),
+                    build_resortmap,
+                    version,
+                    price,
+                    options,
+                )
+
+
+# Build the compact copy of the resort columns that is shipped once to the browser in clientside filtering mode, along with the empty template of the map figure that the browser swaps the filtered columns into.
+# It is built once per dataset version and kept in clientside_columns_cache, rather than built on every page load.
+def build_clientside_columns(version):
+    df = version.resorts
+    option_bits = np.zeros(len(df), dtype=np.uint8)
+    for bit, column in enumerate(OPTION_COLUMNS):
+        option_bits |= df[column].to_numpy(dtype=bool).astype(np.uint8) << bit
+    return {
+        "options": OPTION_COLUMNS,
+        "price": df["Price"].tolist(),
+        "option_bits": option_bits.tolist(),
+        "lat": df["Latitude"].tolist(),
+        "lon": df["Longitude"].tolist(),
+        "z": df["Total slopes"].tolist(),
+        "customdata": with_yes_no(df[HOVER_COLUMNS], HOVER_COLUMNS).values.tolist(),
+        "figure": density_map_template(tuple(HOVER_COLUMNS)),
+    }
+
+
+# Set SHARED_DATASET to keep the dataset and its indexes in shared memory. gunicorn_preload.conf.py sets it, and it only pays off when the app is imported once in the gunicorn master and the workers are forked from it.
+SHARED_DATASET = bool(os.environ.get("SHARED_DATASET"))
+
+# The attributes of a dataset version holding the NumPy arrays of the derived indexes, which are moved into shared memory along with the dataframe
+SHARED_INDEXES = [
+    "filter_index",
+    "rank_index",
+    "catalog",
+    "top_resorts",
+    "grid_pyramid",
+    "latitude",
+    "longitude",
+    "total_slopes",
+]
+
+
+# Build the derived indexes of a new dataset version before it is published. The filter and rank indexes are cheap to rebuild, while the top-resorts table is copied from the previous version and only refreshed for the countries that changed.
+# With PREWARM_FIGURE_CACHE set, the map figures of the new version are also built before it goes live. Under gunicorn --preload this is done once for the first version, before the workers are forked.
+def build_indexes(version, previous):
+    df = version.resorts
+    version.filter_index = build_filter_index(df)
+    version.rank_index = build_rank_index(df)
+    version.grid_pyramid = build_grid_pyramid(df)
+    # Plain arrays of the columns the level-of-detail map reads for every request
+    version.latitude = df["Latitude"].to_numpy(dtype=np.float64)
+    version.longitude = df["Longitude"].to_numpy(dtype=np.float64)
+    version.total_slopes = df["Total slopes"].to_numpy(dtype=np.float64)
+    # The catalog is built with every version, so the dropdown options can never be out of date with the data
+    version.catalog = build_catalog(df)
+    if (
+        previous is None
+        or version.changed_countries is None
+        or version.catalog["metrics"] != previous.catalog["metrics"]
+    ):
+        version.top_resorts = refresh_top_resorts(
+            {}, df, version.catalog, version.catalog["country_ranges"]
+        )
+    else:
+        version.top_resorts = refresh_top_resorts(
+            dict(previous.top_resorts),
+            df,
+            version.catalog,
+            version.changed_countries,
+        )
+    # When the app is preloaded in the gunicorn master, the first version and its indexes are moved into read-only shared memory, which every worker forked afterwards attaches to without copying.
+    # Versions published later by a reload are built inside one worker, so there is nothing to share them with.
+    if SHARED_DATASET and previous is None:
+        version.resorts = share_dataframe(version.resorts)
+        for attribute in SHARED_INDEXES:
+            setattr(version, attribute, share_tree(getattr(version, attribute)))
+    if os.environ.get("PREWARM_FIGURE_CACHE"):
+        prewarm_resortmap_cache(version)
+
+
+# Import the dataframe with four new columns that, for each country, ranks the resorts by elevation, price, slope, and snow cannon count.
+# The data comes from the compiled snapshot when it is up to date with resorts.xlsx (build it with "python resorts_data.py"), otherwise from the spreadsheet itself.
+# Callbacks read dataset.current once and use that version throughout, since a reload can publish a new version at any time.
+# Set RESORTS_SOURCE to load a CSV or Parquet dump instead, which is streamed through the ingest pipeline of resorts_ingest.py (or compiled into the snapshot beforehand, which is much faster to start from).
+dataset = ResortDataset(
+    os.environ.get("RESORTS_SOURCE", "resorts.xlsx"), on_version=build_indexes
 )
 
-# Create the layout for the application
-app.layout = dbc.Container(
-    [
-        dcc.Tabs(
-            id="tabs",
-            children=[
-                # Create the first tab which will hold the map
-                dcc.Tab(
-                    id="maptab",
-                    label="Resort Finder",
-                    children=[
-                        html.Br(),
-                        dbc.Row(html.H2(id="title")),
-                        html.Br(),
-                        dbc.Row(),
-                        dbc.Row(),
-                        dbc.Row(
-                            [
-                                dbc.Col(
-                                    children=[
-                                        dbc.Card(
-                                            children=[
-                                                dcc.Markdown(
-                                                    """
-                            #### **Instructions**
-                            **Use this application to find the perfect ski resort for you!**
-                            **Select from the options below, then use the map on the right to find ski resorts that fit your selections. This map is global, so zoom out and explore!**                           
-                            """,
-                                                    className="dbc",
-                                                ),
-                                            ]
+
+# Set RESORTS_RELOAD_INTERVAL to a number of seconds to reload the dataset whenever resorts.xlsx changes, instead of restarting the app. Each process polls the file on its own.
+def start_reload_watcher():
+    if os.environ.get("RESORTS_RELOAD_INTERVAL"):
+        dataset.watch(float(os.environ["RESORTS_RELOAD_INTERVAL"]))
+
+
+# A thread started in the gunicorn master doesn't survive the fork, so in shared mode the watcher is started in each worker by the post_fork hook of gunicorn_preload.conf.py instead
+if not SHARED_DATASET:
+    start_reload_watcher()
+
+# Set CLIENTSIDE_FILTERING to filter the Resort Finder map in the browser instead of on the server. The resort columns are then sent to the browser once in a dcc.Store, and slider and checklist changes never reach the server.
+# Leave it unset to use the server-side global_resortmap callback, so the two modes can be benchmarked against each other.
+CLIENTSIDE_FILTERING = bool(os.environ.get("CLIENTSIDE_FILTERING"))
+
+# Set MAP_LEVEL_OF_DETAIL to have the server-side map follow the zoom and viewport of the map: resorts in view are combined into grid cells that match the zoom, and raw resorts are only sent once the map is zoomed in.
+# It keeps the payload of the map bounded for very large datasets. It has no effect in clientside filtering mode.
+MAP_LEVEL_OF_DETAIL = bool(os.environ.get("MAP_LEVEL_OF_DETAIL"))
+
+
+# Create the layout for the application. The layout is served by a function so that every page load gets the options and data of the current dataset version.
+def serve_layout():
+    version = dataset.current
+    return dbc.Container(
+        [
+            dcc.Tabs(
+                id="tabs",
+                children=[
+                    # Create the first tab which will hold the map
+                    dcc.Tab(
+                        id="maptab",
+                        label="Resort Finder",
+                        children=[
+                            html.Br(),
+                            dbc.Row(html.H2(id="title")),
+                            # Holds the resort columns for the map in clientside filtering mode, and stays empty otherwise
+                            dcc.Store(
+                                id="resort-columns",
+                                data=(
+                                    clientside_columns_cache.get_or_build(
+                                        version.number,
+                                        build_clientside_columns,
+                                        version,
+                                    )
+                                    if CLIENTSIDE_FILTERING
+                                    else None
+                                ),
+                            ),
+                            html.Br(),
+                            dbc.Row(),
+                            dbc.Row(),
+                            dbc.Row(
+                                [
+                                    dbc.Col(
+                                        children=[
+                                            dbc.Card(
+                                                children=[
+                                                    dcc.Markdown(
+                                                        """
+                                #### **Instructions**
+                                **Use this application to find the perfect ski resort for you!**
+                                **Select from the options below, then use the map on the right to find ski resorts that fit your selections. This map is global, so zoom out and explore!**                           
+                                """,
+                                                        className="dbc",
+                                                    ),
+                                                ]
+                                            ),
+                                            html.Br(),
+                                            dbc.Card(
+                                                [
+                                                    dcc.Markdown(
+                                                        """**Select Your Lift Ticket Price Limit in $USD**"""
+                                                    ),
+                                                    html.Br(),
+                                                    dcc.Slider(
+                                                        id="price-select",
+                                                        min=PRICE_MIN,
+                                                        max=PRICE_MAX,
+                                                        step=PRICE_STEP,
+                                                        value=PRICE_MAX,
+                                                        className="dbc",
+                                                    ),
+                                                ]
+                                            ),
+                                            #                         dcc.RadioItems(
+                                            #                             id="nightski",
+                                            #                             options=["Has Night Skiing", "Does Not Have Night Skiing"],
+                                            #                             value="Has Night Skiing",
+                                            #                         ),
+                                            html.Br(),
+                                            dbc.Card(
+                                                [
+                                                    dcc.Markdown(
+                                                        """**Select Your Resort Options**"""
+                                                    ),
+                                                    dcc.Checklist(
+                                                        id="resort-options",
+                                                        options=[
+                                                            # We will use the exact names of the columns as values for the checklist, as this will make the dataframe filtering logic much easier to handle below
+                                                            {
+                                                                "label": "Has Snow Park",
+                                                                "value": "Snowparks",
+                                                            },
+                                                            {
+                                                                "label": "Has Night Skiing",
+                                                                "value": "Nightskiing",
+                                                            },
+                                                            {
+                                                                "label": "Has Summer Skiing",
+                                                                "value": "Summer skiing",
+                                                            },
+                                                        ],
+                                                        value=[],
+                                                        className="dbc",
+                                                    ),
+                                                ]
+                                            ),
+                                            html.Br(),
+                                            #                         html.H6(
+                                            #                             "Instructions: Select from the options above, then use the map on the right to find ski resorts that fit your selections. This map is global, so zoom out and explore!",
+                                            #                             style={"font-weight": "bold"},
+                                            #                         ),
+                                        ],
+                                        width=3,
+                                    ),
+                                    #                 html.H2(id="debugging"),
+                                    dbc.Col(
+                                        dcc.Graph(
+                                            id="resort-map",
+                                            # The map callback only sends the trace of the figure, which is patched into this empty map
+                                            figure=density_map_template(
+                                                tuple(HOVER_COLUMNS)
+                                            ),
+                                            responsive=False,
                                         ),
-                                        html.Br(),
-                                        dbc.Card(
-                                            [
-                                                dcc.Markdown(
-                                                    """**Select Your Lift Ticket Price Limit in $USD**"""
+                                        width=9,
+                                    ),
+                                ]
+                            ),
+                            dbc.Row(
+                                "Disclaimer: This application should not be used to plan an actual ski vacation. Its sole purpose is to illustrate the use of the Plotly and Dash libraries. The underlying data may contain many inaccuracies.",
+                                style={"text-align": "center", "color": "red"},
+                            ),
+                        ],
+                        className="dbc",
+                    ),
+                    dcc.Tab(
+                        label="Resort Rankings",
+                        children=[
+                            html.Br(),
+                            dbc.Row(html.H2(id="title2")),
+                            dbc.Row(
+                                children=[
+                                    dbc.Col(
+                                        children=[
+                                            dbc.Card(
+                                                [
+                                                    dcc.Markdown(
+                                                        """
+                                                        #### **Instructions**  
+                                                        Select a Continent, Country, and Metric for which to rank ski resorts. Then hover over the bar graph to see the rankings of resorts.
+                                                        """,
+                                                        className="dbc",
+                                                    ),
+                                                ]
+                                            ),
+                                            html.Br(),
+                                            # Continent selector
+                                            dcc.Markdown("""Select a Continent"""),
+                                            dcc.Dropdown(
+                                                id="continent-select",
+                                                options=list(
+                                                    version.catalog["continents"]
                                                 ),
-                                                html.Br(),
-                                                dcc.Slider(
-                                                    id="price-select",
-                                                    min=0,
-                                                    max=150,
-                                                    step=25,
-                                                    value=150,
-                                                    className="dbc",
+                                                value="Europe",
+                                                className="dbc",
+                                            ),
+                                            # Holds the countries of every continent in clientside filtering mode, so that the country options are looked up in the browser, and stays empty otherwise
+                                            dcc.Store(
+                                                id="continent-countries",
+                                                data=(
+                                                    version.catalog["continents"]
+                                                    if CLIENTSIDE_FILTERING
+                                                    else None
                                                 ),
-                                            ]
-                                        ),
-                                        #                         dcc.RadioItems(
-                                        #                             id="nightski",
-                                        #                             options=["Has Night Skiing", "Does Not Have Night Skiing"],
-                                        #                             value="Has Night Skiing",
-                                        #                         ),
-                                        html.Br(),
-                                        dbc.Card(
-                                            [
+                                            ),
+                                            html.Br(),
+                                            html.Br(),
+                                            # Country selector
+                                            dbc.Row(
                                                 dcc.Markdown(
-                                                    """**Select Your Resort Options**"""
-                                                ),
-                                                dcc.Checklist(
-                                                    id="resort-options",
-                                                    options=[
-                                                        # We will use the exact names of the columns as values for the checklist, as this will make the dataframe filtering logic much easier to handle below
-                                                        {
-                                                            "label": "Has Snow Park",
-                                                            "value": "Snowparks",
-                                                        },
-                                                        {
-                                                            "label": "Has Night Skiing",
-                                                            "value": "Nightskiing",
-                                                        },
-                                                        {
-                                                            "label": "Has Summer Skiing",
-                                                            "value": "Summer skiing",
-                                                        },
-                                                    ],
-                                                    value=[],
+                                                    """Select a Country""",
+                                                    className="dbc",
+                                                )
+                                            ),
+                                            dbc.Row(
+                                                dcc.Dropdown(
+                                                    id="country-options",
+                                                    value="Austria",
                                                     className="dbc",
                                                 ),
-                                            ]
-                                        ),
-                                        html.Br(),
-                                        #                         html.H6(
-                                        #                             "Instructions: Select from the options above, then use the map on the right to find ski resorts that fit your selections. This map is global, so zoom out and explore!",
-                                        #                             style={"font-weight": "bold"},
-                                        #                         ),
-                                    ],
-                                    width=3,
-                                ),
-                                #                 html.H2(id="debugging"),
-                                dbc.Col(
-                                    dcc.Graph(id="resort-map", responsive=False),
-                                    width=9,
-                                ),
-                            ]
-                        ),
-                        dbc.Row(
-                            "Disclaimer: This application should not be used to plan an actual ski vacation. Its sole purpose is to illustrate the use of the Plotly and Dash libraries. The underlying data may contain many inaccuracies.",
-                            style={"text-align": "center", "color": "red"},
-                        ),
-                    ],
-                    className="dbc",
-                ),
-                dcc.Tab(
-                    label="Resort Rankings",
-                    children=[
-                        html.Br(),
-                        dbc.Row(html.H2(id="title2")),
-                        dbc.Row(
-                            children=[
-                                dbc.Col(
-                                    children=[
-                                        dbc.Card(
-                                            [
+                                            ),
+                                            html.Br(),
+                                            html.Br(),
+                                            # Metric selector
+                                            dbc.Row(
                                                 dcc.Markdown(
-                                                    """
-                                                    #### **Instructions**  
-                                                    Select a Continent, Country, and Metric for which to rank ski resorts. Then hover over the bar graph to see the rankings of resorts.
-                                                    """,
+                                                    """Select a Metric""",
                                                     className="dbc",
-                                                ),
-                                            ]
-                                        ),
-                                        html.Br(),
-                                        # Continent selector
-                                        dcc.Markdown("""Select a Continent"""),
-                                        dcc.Dropdown(
-                                            id="continent-select",
-                                            options=resorts["Continent"].unique(),
-                                            value="Europe",
-                                            className="dbc",
-                                        ),
-                                        html.Br(),
-                                        html.Br(),
-                                        # Country selector
-                                        dbc.Row(
-                                            dcc.Markdown(
-                                                """Select a Country""",
-                                                className="dbc",
-                                            )
-                                        ),
-                                        dbc.Row(
-                                            dcc.Dropdown(
-                                                id="country-options",
-                                                value="Austria",
-                                                className="dbc",
+                                                )
                                             ),
-                                        ),
-                                        html.Br(),
-                                        html.Br(),
-                                        # Metric selector
-                                        dbc.Row(
-                                            dcc.Markdown(
-                                                """Select a Metric""",
-                                                className="dbc",
-                                            )
-                                        ),
+                                            dbc.Row(
+                                                # For the metrics dropdown, the options are the metrics of the catalog
+                                                dcc.Dropdown(
+                                                    id="metric-select",
+                                                    options=version.catalog["metrics"],
+                                                    value="Price",
+                                                    className="dbc",
+                                                )
+                                            ),
+                                        ],
+                                        width=3,
+                                    ),
+                                    dbc.Col(
                                         dbc.Row(
-                                            # For the metrics dropdown, the options will be the numeric columns of the dataframe, except for the first column where the rows are arbitrarily numbered
-                                            dcc.Dropdown(
-                                                id="metric-select",
-                                                options=resorts.select_dtypes(
-                                                    "number"
-                                                ).columns[1:],
-                                                value="Price",
-                                                className="dbc",
+                                            dcc.Graph(
+                                                id="resort-graph",
+                                                # The bar graph callback only sends the trace and the axis title, which are patched into this empty graph
+                                                figure=bar_template("Price"),
                                             )
                                         ),
-                                    ],
-                                    width=3,
-                                ),
-                                dbc.Col(dbc.Row(dcc.Graph(id="resort-graph")), width=6),
-                                dbc.Col(
-                                    children=[
-                                        dbc.Card(
-                                            children=[
-                                                dcc.Markdown(
-                                                    """
-                                            #### **Resort Report Card**  
-                                            Mouse over the bar graph to see resort rankings.
-                                            """,
-                                                    className="dbc",
-                                                ),
-                                                dbc.Card(
-                                                    dbc.Row(html.H5(id="resort-name")),
-                                                ),
-                                                dbc.Card(
-                                                    children=[
+                                        width=6,
+                                    ),
+                                    dbc.Col(
+                                        children=[
+                                            dbc.Card(
+                                                children=[
+                                                    dcc.Markdown(
+                                                        """
+                                                #### **Resort Report Card**  
+                                                Mouse over the bar graph to see resort rankings.
+                                                """,
+                                                        className="dbc",
+                                                    ),
+                                                    dbc.Card(
                                                         dbc.Row(
-                                                            html.P(id="elevation-rank")
+                                                            html.H5(id="resort-name")
                                                         ),
-                                                    ]
-                                                ),
-                                                dbc.Card(
-                                                    dbc.Row(html.P(id="price-rank")),
-                                                ),
-                                                dbc.Card(
-                                                    dbc.Row(html.P(id="slope-rank")),
-                                                ),
-                                                dbc.Card(
-                                                    dbc.Row(html.P(id="cannon-rank")),
-                                                ),
-                                            ]
-                                        ),
-                                        html.Br(),
-                                        dbc.Card(
-                                            dcc.Markdown(
-                                                """
-                                                #### **Ranking Guide**
-                                                **Elevation**: A higher number indicates a higher elevation.  
-                                                **Lift Ticket Price**: A higher number indicates a higher price.  
-                                                **Slope Count**: A higher number indicates a larger number of slopes.  
-                                                **Cannon Count**: A higher number indicates a larger number of snow cannons.  
+                                                    ),
+                                                    dbc.Card(
+                                                        children=[
+                                                            dbc.Row(
+                                                                html.P(
+                                                                    id="elevation-rank"
+                                                                )
+                                                            ),
+                                                        ]
+                                                    ),
+                                                    dbc.Card(
+                                                        dbc.Row(
+                                                            html.P(id="price-rank")
+                                                        ),
+                                                    ),
+                                                    dbc.Card(
+                                                        dbc.Row(
+                                                            html.P(id="slope-rank")
+                                                        ),
+                                                    ),
+                                                    dbc.Card(
+                                                        dbc.Row(
+                                                            html.P(id="cannon-rank")
+                                                        ),
+                                                    ),
+                                                ]
+                                            ),
+                                            html.Br(),
+                                            dbc.Card(
+                                                dcc.Markdown(
+                                                    """
+                                                    #### **Ranking Guide**
+                                                    **Elevation**: A higher number indicates a higher elevation.  
+                                                    **Lift Ticket Price**: A higher number indicates a higher price.  
+                                                    **Slope Count**: A higher number indicates a larger number of slopes.  
+                                                    **Cannon Count**: A higher number indicates a larger number of snow cannons.  
                                                 
-                                                """,
-                                                className="dbc",
-                                            )
-                                        ),
-                                    ],
-                                    width=3,
-                                ),
-                            ]
-                        ),
-                        dbc.Row(
-                            "Disclaimer: This application should not be used to plan an actual ski vacation. Its sole purpose is to illustrate the use of the Plotly and Dash libraries. The underlying data may contain many inaccuracies.",
-                            style={"text-align": "center", "color": "red"},
-                        ),
-                    ],
-                    className="dbc",
-                ),
-            ],
-            className="dbc",
-        )
-    ]
-)
+                                                    """,
+                                                    className="dbc",
+                                                )
+                                            ),
+                                        ],
+                                        width=3,
+                                    ),
+                                ]
+                            ),
+                            dbc.Row(
+                                "Disclaimer: This application should not be used to plan an actual ski vacation. Its sole purpose is to illustrate the use of the Plotly and Dash libraries. The underlying data may contain many inaccuracies.",
+                                style={"text-align": "center", "color": "red"},
+                            ),
+                        ],
+                        className="dbc",
+                    ),
+                ],
+                className="dbc",
+            )
+        ]
+    )
 
 
-@app.callback(
-    # Outputs for the title and resort map
-    Output("title", "children"),
-    Output("resort-map", "figure"),
-    #     Output("debugging", "children"),
-    # Inputs from the Slider and the checklist elements
-    Input("price-select", "value"),
-    Input("resort-options", "value"),
-    #     Input("nightski", "value"),
-)
+app.layout = serve_layout
+
+
+@instrumented
 def global_resortmap(price, options):
-    # Define the dataframe. First, we will pre-filter the dataframe so that only Price values that are lower than the selected slider price are considered
-    df = resorts.loc[resorts["Price"] < price]
-
-    # This logic filters the dataframe based on the options selected from the checklist
-    # If all three options are selected, filter the dataframe so that results that have all three options are included as "Yes"
-    if len(options) == 3:
-        df = df.loc[
-            (df["Nightskiing"] == "Yes")
-            & (df["Snowparks"] == "Yes")
-            & (df["Summer skiing"] == "Yes")
-        ]
-    # If two options are selected, filter the dataframe so that the two selected options are "Yes" for the included resorts. The included resorts may or may not have the unselected option.
-    elif len(options) == 2:
-        df = df.loc[(df[options[0]] == "Yes") & (df[options[1]] == "Yes")]
-    # If only one option is selected, filter the dataframe so that the selected option is a "Yes" for the included resorts. The included resorts may or may not have the unselected options.
-    elif len(options) == 1:
-        df = df.loc[df[options[0]] == "Yes"]
-    # If no options are selected, the dataframe will not be filtered any further and all resorts fitting the selected price limit will be included.
-
-    # Construct the density_mapbox figure
-    fig = px.density_mapbox(
-        df,
-        lat="Latitude",
-        lon="Longitude",
-        z="Total slopes",
-        center={"lat": 44.5, "lon": -103.5},
-        mapbox_style="open-street-map",
-        zoom=3.5,
-        color_continuous_scale="Plotly3",
-        hover_data=["Resort", "Price", "Snowparks", "Nightskiing", "Summer skiing"],
-        width=1000,
-        height=800,
+    # The title and trace come from the figure cache, and only the trace is sent, as a partial update of the map figure
+    version, options = dataset.current, canonical_options(options)
+    title, trace = cached_resortmap(version, price, options)
+    fig = Patch()
+    fig["data"][0] = trace
+    return title, fig
+
+
+@instrumented
+def global_resortmap_lod(price, options, relayout_data):
+    version = dataset.current
+    zoom, bounds = map_view(relayout_data)
+    with phase("filter"):
+        rows = filter_rows(version.filter_index, price, canonical_options(options))
+        rows = rows_in_view(version, rows, bounds)
+        if zoom >= RAW_ZOOM or len(rows) <= RAW_POINT_LIMIT:
+            df, hover_data = version.resorts.iloc[rows], HOVER_COLUMNS
+        else:
+            level = min(max(int(zoom) + GRID_LEVEL_OFFSET, 0), GRID_LEVELS - 1)
+            df, hover_data = aggregate_rows(version, rows, level), ["Resorts"]
+    with phase("figure"):
+        fig = density_map_figure(df, hover_data)
+        # Keep the user's zoom and position when the figure is replaced, instead of jumping back to the initial view
+        fig["layout"] = dict(fig["layout"], uirevision="resort-map")
+    return resortmap_title(price), fig
+
+
+# In clientside filtering mode, the filter_resort_map function in assets/clientside.js filters the stored resort columns and swaps the result into the trace of the map figure.
+# Otherwise the map is built on the server, by global_resortmap_lod in level-of-detail mode and by global_resortmap from the figure cache otherwise.
+if CLIENTSIDE_FILTERING:
+    app.clientside_callback(
+        ClientsideFunction(namespace="resorts", function_name="filter_resort_map"),
+        Output("title", "children"),
+        Output("resort-map", "figure"),
+        Input("price-select", "value"),
+        Input("resort-options", "value"),
+        State("resort-columns", "data"),
     )
+elif MAP_LEVEL_OF_DETAIL:
+    app.callback(
+        Output("title", "children"),
+        Output("resort-map", "figure"),
+        Input("price-select", "value"),
+        Input("resort-options", "value"),
+        Input("resort-map", "relayoutData"),
+    )(global_resortmap_lod)
+else:
+    app.callback(
+        # Outputs for the title and resort map
+        Output("title", "children"),
+        Output("resort-map", "figure"),
+        #     Output("debugging", "children"),
+        # Inputs from the Slider and the checklist elements
+        Input("price-select", "value"),
+        Input("resort-options", "value"),
+        #     Input("nightski", "value"),
+    )(global_resortmap)
+
 
-    # Create the dynamic title that will be passed back to the title element
-    title = (
-        f"Ski Resorts by Total Slopes with a Lift Ticket Price of Less Than ${price}"
+# Report the hit and miss counters of the Resort Finder figure cache, so that the hit rate can be checked on a running server
+@server.route("/_resortmap-cache")
+def resortmap_cache_stats():
+    return resortmap_cache.info()
+
+
+# The same counters in the Prometheus text format, for the metrics route
+def resortmap_cache_metrics():
+    info = resortmap_cache.info()
+    return "\n".join(
+        [
+            "# HELP resortmap_cache_hits_total Resort Finder figure cache hits.",
+            "# TYPE resortmap_cache_hits_total counter",
+            f"resortmap_cache_hits_total {info['hits']}",
+            "# HELP resortmap_cache_misses_total Resort Finder figure cache misses.",
+            "# TYPE resortmap_cache_misses_total counter",
+            f"resortmap_cache_misses_total {info['misses']}",
+        ]
     )
-    return title, fig
 
 
 # Callback function for selecting the countries available from the selected continent
-@app.callback(
-    Output("country-options", "options"),
-    # Inputs from the Slider and the checklist elements
-    Input("continent-select", "value"),
-)
+@instrumented
 def continent_filter(continent):
-    return resorts[resorts["Continent"] == continent]["Country"].unique()
+    # The countries are looked up in the catalog of the current dataset version
+    return dataset.current.catalog["continents"].get(continent, [])
+
+
+# In clientside filtering mode, the country_options function in assets/clientside.js looks the countries up in the catalog inlined into the layout, so that no request reaches the server
+if CLIENTSIDE_FILTERING:
+    app.clientside_callback(
+        ClientsideFunction(namespace="resorts", function_name="country_options"),
+        Output("country-options", "options"),
+        Input("continent-select", "value"),
+        State("continent-countries", "data"),
+    )
+else:
+    app.callback(
+        Output("country-options", "options"),
+        # Input from the continent dropdown
+        Input("continent-select", "value"),
+    )(continent_filter)
 
 
 # Callback function to create the bar graph based on the country and metric selections
@@ -357,26 +887,47 @@ def continent_filter(continent):
     Input("country-options", "value"),
     Input("metric-select", "value"),
 )
+@instrumented
 def graph_generator(country, metric):
     if not country or not metric:
         raise PreventUpdate
-    # Filter the dataframe to include only the data for the selection country, then sort the values on the selected metric. Finally, take only the top 10 values
-    sorted_data = resorts[resorts["Country"] == country].sort_values(
-        by=metric, ascending=False
-    )[0:10]
-
-    fig = px.bar(
-        sorted_data,
-        x="Resort",
-        y=metric,
-        height=750,
-        # In addition to building the graph, we also want to pass the Resort name as custom_data back to the output. This will allow us to "select" the resort name when we hover over that resort's data in our bar graph
-        custom_data=["Resort"],
+    # The title and trace come from the bar graph cache. As for the map, only a miss goes through the figure executor, and concurrent misses for the same bar graph share one build
+    version = dataset.current
+    title, trace = figure_executor.cached(
+        resort_graph_cache,
+        (version.number, country, metric),
+        build_resort_graph,
+        version,
+        country,
+        metric,
     )
-    title = f"Top {len(sorted_data)} Resort(s) in {country} by {metric}"
+    # Only the trace and the axis title change with the selection, so only they are sent, as a partial update of the bar graph
+    fig = Patch()
+    fig["data"][0] = trace
+    fig["layout"]["yaxis"]["title"]["text"] = metric
     return title, fig
 
 
+# Build the title and the bar graph trace of the top 10 resorts of a country by a metric. The trace is frozen like the map's, since it is cached and shared by every request for the same bar graph.
+def build_resort_graph(version, country, metric):
+    # Look up the top 10 resorts of the selected country by the selected metric in the precomputed top-resorts table, then take just those rows from the dataframe
+    with phase("filter"):
+        rows = version.top_resorts.get(country, {}).get(metric, [])
+        sorted_data = version.resorts.iloc[rows]
+
+    with phase("figure"):
+        trace = frozen_trace(
+            dict(
+                bar_template(metric)["data"][0],
+                x=sorted_data["Resort"].to_numpy(),
+                y=sorted_data[metric].to_numpy(),
+                customdata=sorted_data[["Resort", "Country"]].to_numpy(),
+            )
+        )
+    title = f"Top {len(sorted_data)} Resort(s) in {country} by {metric}"
+    return title, trace
+
+
 # Callback function to modify the report card. We will pass in the hoverData from the resort graph (resort name in this case) and return the rankings for that resort.
 @app.callback(
     Output("resort-name", "children"),
@@ -386,31 +937,32 @@ def graph_generator(country, metric):
     Output("cannon-rank", "children"),
     Input("resort-graph", "hoverData"),
 )
+@instrumented
 def report_card(hoverData):
     if not hoverData:
         raise PreventUpdate
-    # We need to access the resort name from the hoverData that was passed in. It's a standard json object.
-    resort_name = hoverData["points"][0]["customdata"][0]
-    # After obtaining the resort name, we can use that to pull the various ranks from the dataframe
-    elev_rank = resorts.loc[resorts["Resort"] == resort_name]["Elevation Rank"].item()
-    price_rank = resorts.loc[resorts["Resort"] == resort_name][
-        "Lift Ticket Price Rank"
-    ].item()
-    slope_rank = resorts.loc[resorts["Resort"] == resort_name][
-        "Slope Count Rank"
-    ].item()
-    cannon_rank = resorts.loc[resorts["Resort"] == resort_name][
-        "Cannon Count Rank"
-    ].item()
+    # We need to access the resort name and its country from the hoverData that was passed in. It's a standard json object.
+    resort_name, country = hoverData["points"][0]["customdata"]
+    # After obtaining the resort, we can use that to pull all four ranks from the rank index at once
+    rank_index = dataset.current.rank_index
+    with phase("filter"):
+        row = rank_index["rows"].get((country, resort_name))
+    if row is None:
+        raise PreventUpdate
+    elev_rank, price_rank, slope_rank, cannon_rank = rank_index["ranks"][row].tolist()
     resort_text = f"Resort Name: {resort_name}"
     elev_text = f"Elevation Rank: {elev_rank}"
-    price_text = f"Lift Ticket Price Rank: {elev_rank}"
+    price_text = f"Lift Ticket Price Rank: {price_rank}"
     slope_text = f"Slope Count Rank: {slope_rank}"
     cannon_text = f"Cannon Count Rank: {cannon_rank}"
 
     return resort_text, elev_text, price_text, slope_text, cannon_text
 
 
+# Set CALLBACK_METRICS to record the latency, phase timings and response size of every callback, served in the Prometheus text format from /metrics
+install_metrics(app, collectors=[resortmap_cache_metrics, figure_executor.metrics])
+
+
 if __name__ == "__main__":
     app.run_server()
 #     app.run_server(port=2381, jupyter_mode="external", debug=True)